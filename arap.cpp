@@ -3,9 +3,10 @@
 #include <cmath>
 #include <algorithm>
 #include <iostream>
-#include <map>
+#include <climits>
 #include <bitset>
-#include <queue>
+#include <thread>
+#include <vector>
 
 #define R (0)
 #define G (1)
@@ -13,106 +14,154 @@
 
 using namespace std;
 
-extern "C" void compute_mask(bool * mask, char * orig, int width, int height, int tolerance) {
+/**
+ * Whether pixel is within tolerance of background color
+ */
+inline bool is_background(const char * px, const int * lo, const int * up) {
+    int r = px[R]&255;
+    int g = px[G]&255;
+    int b = px[B]&255;
+    return lo[R] <= r && r <= up[R]
+        && lo[G] <= g && g <= up[G]
+        && lo[B] <= b && b <= up[B];
+}
 
-    int empty_r = orig[0]&255;
-    int empty_g = orig[1]&255;
-    int empty_b = orig[2]&255;
+/**
+ * Clears mask of background, i.e. of pixels of color of the top left pixel connected to any border of the image.
+ * Only color channels are compared, pixels are channels bytes apart.
+ * Scanline fill: each seed is extended into whole horizontal span, which is filled at once,
+ * and only one seed per adjacent span of the row above and below is pushed.
+ * Mask has to be all true on input, it's used as bitmap of visited pixels as well,
+ * because only background pixels are ever visited.
+ */
+extern "C" void compute_mask(bool * mask, char * orig, int width, int height, int channels, int tolerance) {
+    if (width <= 0 || height <= 0) { return; }
 
     // bounds
-    int lo_r = empty_r - tolerance;
-    int lo_g = empty_g - tolerance;
-    int lo_b = empty_b - tolerance;
-
-    int up_r = empty_r + tolerance;
-    int up_g = empty_g + tolerance;
-    int up_b = empty_b + tolerance;
-
-    // queue
-    queue<int> queue_x;
-    queue<int> queue_y;
+    int lo[3], up[3];
+    for (int c=0; c<3; c++) {
+        lo[c] = (orig[c]&255) - tolerance;
+        up[c] = (orig[c]&255) + tolerance;
+    }
 
-    queue_x.push(0);
-    queue_y.push(0);
+    vector<ptrdiff_t> seeds;
 
-    // closed
-    bool ** closed = new bool*[height];
-    for (int i=0; i<height; i++) {
-        closed[i] = new bool[width];
-        memset(closed[i], false, width*sizeof(bool));
+    for (int x=0; x<width; x++) {
+        seeds.push_back(x);
+        seeds.push_back((ptrdiff_t)(height-1)*width + x);
+    }
+    for (int y=1; y<height-1; y++) {
+        seeds.push_back((ptrdiff_t)y*width);
+        seeds.push_back((ptrdiff_t)y*width + width-1);
     }
 
-    while (!queue_x.empty()) {
+    while (!seeds.empty()) {
+        ptrdiff_t i = seeds.back();
+        seeds.pop_back();
 
-        int x = queue_x.front();
-        int y = queue_y.front();
+        if (!mask[i] || !is_background(orig + i*channels, lo, up)) { continue; }
 
-        queue_x.pop();
-        queue_y.pop();
+        int y = i / width;
+        ptrdiff_t row = (ptrdiff_t)y*width;
 
-        if (x < 0 || x >= width || y < 0 || y >= height) { continue; }
-        if (closed[y][x]) {continue;}
-        closed[y][x] = true;
+        int left = i - row;
+        while (left > 0 && mask[row+left-1] && is_background(orig + (row+left-1)*channels, lo, up)) { left--; }
+        int right = i - row;
+        while (right < width-1 && mask[row+right+1] && is_background(orig + (row+right+1)*channels, lo, up)) { right++; }
 
-        int px_r = orig[(y*width + x)*3 + R] & 255;
-        int px_g = orig[(y*width + x)*3 + G] & 255;
-        int px_b = orig[(y*width + x)*3 + B] & 255;
+        for (int x=left; x<=right; x++) {
+            mask[row+x] = false;
+        }
 
-        bool foreground = (px_r < lo_r || px_r > up_r
-                        || px_g < lo_g || px_g > up_g
-                        || px_b < lo_b || px_b > up_b);
-        if (!foreground) {
-            mask[y*width+x] = false;
+        for (int ny=y-1; ny<=y+1; ny+=2) {
+            if (ny < 0 || ny >= height) { continue; }
 
-            queue_x.push(x-1); queue_y.push(y);
-            queue_x.push(x+1); queue_y.push(y);
-            queue_x.push(x);   queue_y.push(y-1);
-            queue_x.push(x);   queue_y.push(y+1);
+            bool span = false;
+            for (int x=left; x<=right; x++) {
+                ptrdiff_t n = (ptrdiff_t)ny*width + x;
+                bool open = mask[n] && is_background(orig + n*channels, lo, up);
+                if (open && !span) {
+                    seeds.push_back(n);
+                }
+                span = open;
+            }
         }
     }
 }
 
 /**/
 
-extern "C" void clear(char * orig, char * data, int width, int height) {
+/**
+ * Background pixel of the image, color of the top left pixel without alpha,
+ * or fully transparent pixel if image has alpha channel
+ */
+inline void background(char * orig, int channels, char * bg) {
+    for (int c=0; c<channels; c++) {
+        bg[c] = channels == 4 ? 0 : orig[c];
+    }
+}
+
+extern "C" void clear(char * orig, char * data, int width, int height, int channels) {
 
-    char r = orig[0]&255;
-    char g = orig[1]&255;
-    char b = orig[2]&255;
+    char bg[4];
+    background(orig, channels, bg);
 
-    for (int i=0; i<width*height*3; i+=3) {
-        data[i]   = r;
-        data[i+1] = g;
-        data[i+2] = b;
+    for (ptrdiff_t i=0; i<(ptrdiff_t)width*height*channels; i+=channels) {
+        for (int c=0; c<channels; c++) {
+            data[i+c] = bg[c];
+        }
     }
 
 }
 
-void dot(double * homography, float x, float y, float &rx, float &ry) {
-    double rw;
+extern "C" void clear_rects(char * orig, char * data, int width, int height, int channels, int * rects, int count) {
+    /*
+    Clears only given rectangles, packed as [x0, y0, x1, y1) quadruples
+    */
 
-    rx = homography[0]*x + homography[1]*y + homography[2];
-    ry = homography[3]*x + homography[4]*y + homography[5];
-    rw = homography[6]*x + homography[7]*y + homography[8];
+    char bg[4];
+    background(orig, channels, bg);
 
-    rx /= rw;
-    ry /= rw;
-}
+    for (int k=0; k<count; k++) {
+        int x0 = max(rects[4*k], 0);
+        int y0 = max(rects[4*k + 1], 0);
+        int x1 = min(rects[4*k + 2], width);
+        int y1 = min(rects[4*k + 3], height);
 
-//
-void store(std::map<int,int> &left, std::map<int,int> &right, int x, int y) {
-    if (left.count(y) > 0) {
-        if (x < left[y]) {
-            left[y] = x;
-        } else if (right[y] < x) {
-            right[y] = x;
+        for (int y=y0; y<y1; y++) {
+            for (ptrdiff_t i=((ptrdiff_t)y*width + x0)*channels; i<((ptrdiff_t)y*width + x1)*channels; i+=channels) {
+                for (int c=0; c<channels; c++) {
+                    data[i+c] = bg[c];
+                }
+            }
         }
-    } else {
-        left[y] = x;
-        right[y] = x;
     }
 }
-void points(std::map<int, int> &left, std::map<int,int> &right, bool swap, int x0, int y0, int x1, int y1) {
+
+struct Edges {
+    /*
+    Left and right edge of each scanline of a quad, indexed by y - top
+    */
+    int top;
+    int bottom;
+    std::vector<int> left;
+    std::vector<int> right;
+
+    void reset(int top_, int bottom_) {
+        top = top_;
+        bottom = bottom_;
+        left.assign(bottom - top + 1, INT_MAX);
+        right.assign(bottom - top + 1, INT_MIN);
+    }
+
+    void store(int x, int y) {
+        if (y < top || y > bottom) { return; }
+        left[y - top] = min(left[y - top], x);
+        right[y - top] = max(right[y - top], x);
+    }
+};
+
+void points(Edges &edges, bool swap, int x0, int y0, int x1, int y1) {
 
     if (swap) {
         std::swap(x0, y0);
@@ -127,42 +176,44 @@ void points(std::map<int, int> &left, std::map<int,int> &right, bool swap, int x
         std::swap(y0, y1);
     }
 
-    if (y1 < y0) {
-        y0 = -y0;
-        y1 = -y1;
-    }
+    int step = (y1 < y0) ? -1 : 1;
 
     int D = 2*dy - dx;
 
     // add
     if (swap) {
-        store(left, right, abs(y0), abs(x0));
+        edges.store(y0, x0);
     } else {
-        store(left, right, abs(x0), abs(y0));
+        edges.store(x0, y0);
     }
 
     int y = y0;
     for (int x=x0+1; x<x1; x++) {
         D += 2*dy;
         if (D > 0) {
-            y += 1;
+            y += step;
             D -= 2*dx;
         }
 
         // add
         if (swap) {
-            store(left, right, abs(y), abs(x));
+            edges.store(y, x);
         } else {
-            store(left, right, abs(x), abs(y));
+            edges.store(x, y);
         }
     }
 }
-extern "C" void rasterize(int * corners, std::map<int,int> &left, std::map<int,int> &right) {
+
+void rasterize(int * corners, Edges &edges) {
     /*
     Bresenham's line
     http://en.wikipedia.org/wiki/Bresenham%27s_line_algorithm
     */
 
+    int top = min(min(corners[1], corners[3]), min(corners[5], corners[7]));
+    int bottom = max(max(corners[1], corners[3]), max(corners[5], corners[7]));
+    edges.reset(top, bottom);
+
     for (int i=0; i<4; i++) {
         int x0 = corners[2*i];
         int y0 = corners[2*i + 1];
@@ -172,72 +223,319 @@ extern "C" void rasterize(int * corners, std::map<int,int> &left, std::map<int,i
         int dx = abs(x1-x0);
         int dy = abs(y1-y0);
 
-        points(left, right, (dx <= dy), x0, y0, x1, y1);
+        points(edges, (dx <= dy), x0, y0, x1, y1);
     }
 }
 
-//
-extern "C" void project(double * homography, bool * mask, char * orig, char * data, int width, int height, int * corners) {
+#define NEAREST (0)
+#define BILINEAR (1)
+#define BILINEAR_FLOAT (2)
+
+// fractional bits of fixed point bilinear weights, 2*FRAC + 8 bits have to fit into int
+#define FRAC (11)
+#define ONE (1 << FRAC)
+
+struct Samples {
+    /*
+    Source samples of one scanline run, computed by the first pass and blended by the second one
+    */
+    vector<ptrdiff_t> index;  // source pixel, top left one of bilinear neighbourhood, -1 if pixel is not projected
+    vector<int> wx;  // fixed point weights of right and bottom neighbours
+    vector<int> wy;
+
+    void reserve(int n) {
+        if ((int)index.size() < n) {
+            index.resize(n);
+            wx.resize(n);
+            wy.resize(n);
+        }
+    }
+};
 
-    std::map<int,int> left;
-    std::map<int,int> right;
-    rasterize(corners, left, right);
+void sample_row_float(double * homography, bool * mask, char * orig, char * dst, int width, int height, int channels,
+                      int y, int x_left, int x_right) {
+    /*
+    Reference kernel, bilinear interpolation with float weights pixel by pixel,
+    dst points to output pixel of x_left
+    */
 
-    int max_index = height*width*3;
+    // homography is stepped incrementally along the scanline
+    double hx = homography[0]*x_left + homography[1]*y + homography[2];
+    double hy = homography[3]*x_left + homography[4]*y + homography[5];
+    double hw = homography[6]*x_left + homography[7]*y + homography[8];
 
-    std::map<int,int>::iterator it;
+    for (int x=x_left; x<=x_right; x++, hx += homography[0], hy += homography[3], hw += homography[6]) {
 
-    for (it = left.begin(); it != left.end(); ++it) {
-        int y = it->first;
-        int x_left = it->second;
-        int x_right = right[y];
+        float rx = (float)hx;
+        float ry = (float)hy;
+        rx /= hw;
+        ry /= hw;
 
-        for (int x=x_left; x<=x_right; x++) {
+        //
+        int lft = floor(rx);
+        int rgt = lft+1;
 
-            float rx, ry;
-            dot(homography, (float)x, (float)y, rx, ry);
+        int top = floor(ry);
+        int btm = top+1;
 
-            //
-            int lft = floor(rx);
-            int rgt = lft+1;
+        ptrdiff_t data_index = (ptrdiff_t)(x - x_left)*channels;
 
-            int top = floor(ry);
-            int btm = top+1;
+        if (lft >= 0 && rgt < width && top >= 0 && btm < height) {
+            if (!mask[(ptrdiff_t)round(ry)*width + (int)round(rx)]) {
+                continue;
+            }
 
-            int data_index = (y*width + x)*3;
+            float coefX = rx-(float)lft;
+            float coefY = ry-(float)top;
 
-            if (lft >= 0 && rgt < width && top >= 0 && btm < height) {
-                if (!mask[(int)round(ry)*width + (int)round(rx)]) {
-                    // data[data_index + R] = 255;
-                    // data[data_index + G] = 0;
-                    // data[data_index + B] = 0;
-                    continue;
-                }
+            float tl = (1.f-coefX)*(1.f-coefY);
+            float tr = coefX*(1.f-coefY);
+            float bl = (1.f-coefX)*coefY;
+            float br = coefX*coefY;
+
+            for (int c=0; c<channels; c++) {
+                float clr = tl*((int)round(orig[((ptrdiff_t)top*width + lft)*channels + c])&255)
+                          + tr*((int)round(orig[((ptrdiff_t)top*width + rgt)*channels + c])&255)
+                          + bl*((int)round(orig[((ptrdiff_t)btm*width + lft)*channels + c])&255)
+                          + br*((int)round(orig[((ptrdiff_t)btm*width + rgt)*channels + c])&255);
+                dst[data_index + c] = ((int)clr)&255;
+            }
+        }
+    }
+}
+
+void sample_row(double * homography, bool * mask, char * orig, char * data, int width, int height, int channels,
+                int quality, int y, int x_left, int x_right, Samples &samples) {
+    /*
+    Samples contiguous run of a scanline in two passes, data points to output pixel of x_left.
+    First one maps pixels to source and stores source index and fixed point weights,
+    second one blends channels with integer arithmetic only, in a loop without any calls or divisions.
+    */
+    // untouched scanlines have edges at INT_MAX and INT_MIN, their difference would overflow
+    if (x_right < x_left) { return; }
+    int n = x_right - x_left + 1;
+    samples.reserve(n);
+
+    ptrdiff_t * index = samples.index.data();
+    int * wx = samples.wx.data();
+    int * wy = samples.wy.data();
+
+    double hx = homography[0]*x_left + homography[1]*y + homography[2];
+    double hy = homography[3]*x_left + homography[4]*y + homography[5];
+    double hw = homography[6]*x_left + homography[7]*y + homography[8];
+
+    for (int i=0; i<n; i++, hx += homography[0], hy += homography[3], hw += homography[6]) {
+        float rx = (float)hx;
+        float ry = (float)hy;
+        rx /= hw;
+        ry /= hw;
+
+        // whole bilinear neighbourhood has to be inside of the image, written so that NaN fails too
+        if (!(rx >= 0.f && ry >= 0.f && rx < width-1 && ry < height-1)) {
+            index[i] = -1;
+            continue;
+        }
 
-                float coefX = rx-(float)lft;
-                float coefY = ry-(float)top;
+        ptrdiff_t nearest = (ptrdiff_t)roundf(ry)*width + (int)roundf(rx);
+        if (!mask[nearest]) {
+            index[i] = -1;
+            continue;
+        }
 
-                //std::cout << ry << " " << top << "=" << coefY << std::endl;
-                //std::cout << coefX << " " << coefY << std::endl;
+        // scaling by power of two is exact, so integer part is the same as floor of coordinate
+        int sx = (int)(rx * ONE);
+        int sy = (int)(ry * ONE);
+        index[i] = quality == NEAREST ? nearest : (ptrdiff_t)(sy >> FRAC)*width + (sx >> FRAC);
+        wx[i] = sx & (ONE-1);
+        wy[i] = sy & (ONE-1);
+    }
 
-                float tl = (1.f-coefX)*(1.f-coefY);
-                float tr = coefX*(1.f-coefY);
-                float bl = (1.f-coefX)*coefY;
-                float br = coefX*coefY;
+    const unsigned char * src = (const unsigned char *)orig;
+    unsigned char * dst = (unsigned char *)data;
 
-                for (int c=0; c<3; c++) {
-                    float clr = tl*((int)round(orig[(top*width + lft)*3 + c])&255)
-                              + tr*((int)round(orig[(top*width + rgt)*3 + c])&255)
-                              + bl*((int)round(orig[(btm*width + lft)*3 + c])&255)
-                              + br*((int)round(orig[(btm*width + rgt)*3 + c])&255);
-                    data[data_index + c] = ((int)clr)&255;
-                }
-            } else {
-                //data[data_index + R] = 255;
-                //data[data_index + G] = 0;
-                //data[data_index + B] = 255;
+    if (quality == NEAREST) {
+        for (int i=0; i<n; i++) {
+            if (index[i] < 0) { continue; }
+            const unsigned char * p = src + index[i]*channels;
+            for (int c=0; c<channels; c++) {
+                dst[i*channels + c] = p[c];
             }
         }
+        return;
+    }
+
+    ptrdiff_t stride = (ptrdiff_t)width*channels;
+    for (int i=0; i<n; i++) {
+        if (index[i] < 0) { continue; }
+        const unsigned char * p = src + index[i]*channels;
+        int ax = wx[i];
+        int ay = wy[i];
+        for (int c=0; c<channels; c++) {
+            int top = p[c]*(ONE-ax) + p[channels + c]*ax;
+            int btm = p[stride + c]*(ONE-ax) + p[stride + channels + c]*ax;
+            dst[i*channels + c] = (top*(ONE-ay) + btm*ay) >> (2*FRAC);
+        }
     }
 }
 
+//
+void project_rows(double * homography, bool * mask, char * orig, char * data, int width, int height, int channels, int quality,
+                  int * corners, int * rect, int row_begin, int row_end, Edges &edges, Samples &samples) {
+    /*
+    Projects only scanlines in [row_begin, row_end) of the box.
+    Output is rectangle [x, y, width, height] of the image, rows are in image coordinates and have to lie in it.
+    */
+
+    int top_y = min(min(corners[1], corners[3]), min(corners[5], corners[7]));
+    int btm_y = max(max(corners[1], corners[3]), max(corners[5], corners[7]));
+    if (btm_y < row_begin || top_y >= row_end) { return; }
+
+    rasterize(corners, edges);
+
+    for (int y=max(row_begin, top_y); y<=min(row_end-1, btm_y); y++) {
+        int x_left = max(edges.left[y - top_y], max(rect[0], 0));
+        int x_right = min(edges.right[y - top_y], min(rect[0] + rect[2], width) - 1);
+        if (x_right < x_left) { continue; }
+
+        char * dst = data + ((ptrdiff_t)(y - rect[1])*rect[2] + (x_left - rect[0]))*channels;
+        if (quality == BILINEAR_FLOAT) {
+            sample_row_float(homography, mask, orig, dst, width, height, channels, y, x_left, x_right);
+        } else {
+            sample_row(homography, mask, orig, dst, width, height, channels, quality, y, x_left, x_right, samples);
+        }
+    }
+}
+
+extern "C" void project(double * homography, bool * mask, char * orig, char * data, int width, int height, int channels, int quality, int * corners) {
+    Edges edges;
+    Samples samples;
+    int rect[4] = {0, 0, width, height};
+    project_rows(homography, mask, orig, data, width, height, channels, quality, corners, rect, 0, height, edges, samples);
+}
+
+extern "C" void project_all(double * homographies, int * corners, int count, bool * mask, char * orig, char * data, int width, int height, int channels, int quality, int * rect, int threads) {
+    /*
+    Projects whole mesh in one call,
+    homographies are packed 3x3 matrices and corners packed quads, one of each per box.
+    Output data is rectangle [x, y, width, height] of the image, e.g. a tile of it, source is always whole image.
+    Output is split into horizontal bands, one per thread. Each thread walks all boxes in the same order
+    and writes only rows of its band, so the result doesn't depend on thread count.
+    */
+
+    int y0 = max(rect[1], 0);
+    int y1 = min(rect[1] + rect[3], height);
+    if (y1 <= y0) { return; }
+    threads = max(1, min(threads, y1 - y0));
+
+    auto band = [=](int t) {
+        int row_begin = y0 + (y1 - y0)*t/threads;
+        int row_end = y0 + (y1 - y0)*(t+1)/threads;
+
+        Edges edges;  // reused by all boxes of the band
+        Samples samples;
+        for (int i=0; i<count; i++) {
+            project_rows(homographies + 9*i, mask, orig, data, width, height, channels, quality, corners + 8*i, rect, row_begin, row_end, edges, samples);
+        }
+    };
+
+    std::vector<std::thread> workers;
+    for (int t=1; t<threads; t++) {
+        workers.push_back(std::thread(band, t));
+    }
+    band(0);
+
+    for (size_t t=0; t<workers.size(); t++) {
+        workers[t].join();
+    }
+}
+
+extern "C" int regularize(double * pos, double * rest, double * weight, double * link_cnt, int vertex_count,
+                          int * boxes, double * source_centroids, double * rigid, int box_count,
+                          int * pinned, double * targets, int pinned_count,
+                          int iterations, double tolerance, double * residual) {
+    /*
+    Shape matching iterations over packed lattice arrays, see Lattice.fit and Lattice.average.
+    Stops when maximal vertex displacement of iteration drops below tolerance.
+    Returns number of iterations done, residual of the last one is stored to residual.
+    */
+
+    std::vector<double> acc(2*vertex_count);
+    std::vector<double> last(2*vertex_count);
+
+    int it = 0;
+    while (it < iterations) {
+        it++;
+
+        std::copy(pos, pos + 2*vertex_count, last.begin());
+
+        for (int k=0; k<pinned_count; k++) {
+            pos[2*pinned[k]]     = targets[2*k];
+            pos[2*pinned[k] + 1] = targets[2*k + 1];
+        }
+
+        std::fill(acc.begin(), acc.end(), 0.0);
+
+        for (int b=0; b<box_count; b++) {
+            int * box = boxes + 4*b;
+
+            // target centroid
+            double w = 0, qc_x = 0, qc_y = 0;
+            for (int i=0; i<4; i++) {
+                double wi = weight[box[i]];
+                w += wi;
+                qc_x += wi*pos[2*box[i]];
+                qc_y += wi*pos[2*box[i] + 1];
+            }
+            qc_x /= w;
+            qc_y /= w;
+
+            double pc_x = source_centroids[2*b];
+            double pc_y = source_centroids[2*b + 1];
+
+            double p_roof_x[4], p_roof_y[4];
+            double r_00 = 0, r_01 = 0;
+            for (int i=0; i<4; i++) {
+                double wi = weight[box[i]];
+                p_roof_x[i] = rest[2*box[i]] - pc_x;
+                p_roof_y[i] = rest[2*box[i] + 1] - pc_y;
+
+                double q_roof_x = pos[2*box[i]] - qc_x;
+                double q_roof_y = pos[2*box[i] + 1] - qc_y;
+
+                r_00 += wi*(p_roof_x[i]*q_roof_x + p_roof_y[i]*q_roof_y);
+                r_01 += wi*(p_roof_x[i]*q_roof_y - p_roof_y[i]*q_roof_x);
+            }
+
+            double mi = 1/sqrt(r_00*r_00 + r_01*r_01);
+            r_00 *= mi;
+            r_01 *= mi;
+
+            for (int i=0; i<4; i++) {
+                double x = r_00*p_roof_x[i] - r_01*p_roof_y[i] + qc_x;
+                double y = r_01*p_roof_x[i] + r_00*p_roof_y[i] + qc_y;
+
+                rigid[8*b + 2*i]     = x;
+                rigid[8*b + 2*i + 1] = y;
+
+                acc[2*box[i]]     += x;
+                acc[2*box[i] + 1] += y;
+            }
+        }
+
+        double max_d = 0;
+        for (int v=0; v<vertex_count; v++) {
+            double x = acc[2*v]/link_cnt[v];
+            double y = acc[2*v + 1]/link_cnt[v];
+
+            max_d = max(max_d, max(fabs(x - last[2*v]), fabs(y - last[2*v + 1])));
+
+            pos[2*v]     = x;
+            pos[2*v + 1] = y;
+        }
+
+        *residual = max_d;
+        if (max_d < tolerance) { break; }
+    }
+
+    return it;
+}
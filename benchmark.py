@@ -0,0 +1,566 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+from classes import Homography
+from classes.Box import Box
+from classes.CWrapper import CWrapper
+from classes.Grid import Grid
+from classes.ImageData import ImageData
+from classes.Lattice import Lattice
+from classes.Point import Point
+
+
+def square_lattice(n, size=32):
+    """
+    Creates vertices and boxes of n x n lattice of boxes with given size
+    :return: (vertices, boxes)
+    """
+    ys, xs = np.mgrid[0:n+1, 0:n+1]
+    vertices = np.stack((xs.ravel(), ys.ravel()), axis=1) * size
+
+    index = np.arange((n+1)**2).reshape(n+1, n+1)
+    boxes = np.stack((index[:-1, :-1], index[:-1, 1:], index[1:, 1:], index[1:, :-1]), axis=-1).reshape(-1, 4)
+    return vertices, boxes
+
+
+def iterations_per_second(fn, duration):
+    """ Calls fn repeatedly for at least given duration in seconds """
+    count = 0
+    start = time.perf_counter()
+    while True:
+        fn()
+        count += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            return count / elapsed
+
+
+def bench_regularize(args):
+    """ Compares regularization speed of per-object Box/Point path, array-backed Lattice and its native port """
+
+    cw = CWrapper()
+
+    print("{:>6} {:>8} {:>12} {:>12} {:>12} {:>8} {:>10}".format(
+        "grid", "boxes", "objects it/s", "lattice it/s", "native it/s", "speedup", "max diff"))
+
+    for n in args.sizes:
+        vertices, boxes = square_lattice(n)
+
+        # deform the lattice a bit so the fit has something to do
+        rng = np.random.default_rng(0)
+        moved = vertices + rng.normal(0, 4, vertices.shape)
+
+        points = [Point(int(x), int(y)) for x, y in vertices]
+        objects = [Box(None, *[points[i] for i in box]) for box in boxes]
+        for p, (x, y) in zip(points, moved):
+            p.x = x
+            p.y = y
+
+        def run_objects():
+            for box in objects:
+                box.fit()
+            for point in points:
+                point.average_linked()
+
+        lattice = Lattice(vertices, boxes)
+        lattice.pos[:] = moved
+
+        native = Lattice(vertices, boxes, cw)
+        native.pos[:] = moved
+
+        for _ in range(args.check):
+            run_objects()
+            lattice.regularize()
+            native.regularize()
+        expected = np.array([p.coor for p in points])
+        diff = max(np.abs(expected - lattice.pos).max(), np.abs(expected - native.pos).max())
+
+        objects_ips = iterations_per_second(run_objects, args.duration)
+        lattice_ips = iterations_per_second(lattice.regularize, args.duration)
+
+        # native iterations run in batches, as they would in one frame
+        native_ips = args.batch * iterations_per_second(lambda: native.regularize(iterations=args.batch), args.duration)
+
+        print("{:>6} {:>8} {:>12.1f} {:>12.1f} {:>12.1f} {:>7.1f}x {:>10.2e}".format(
+            "{0}x{0}".format(n), len(boxes), objects_ips, lattice_ips, native_ips, native_ips/objects_ips, diff))
+
+
+def bench_homography(args):
+    """ Compares batched closed form homographies with per-box solver of Box, both in accuracy and speed """
+
+    size = 32
+    vertices, boxes = square_lattice(args.size, size)
+
+    rng = np.random.default_rng(0)
+    moved = vertices + rng.normal(0, args.noise, vertices.shape)
+
+    points = [Point(int(x), int(y)) for x, y in vertices]
+    objects = [Box(None, *[points[i] for i in box]) for box in boxes]
+    for p, (x, y) in zip(points, moved):
+        p.x = x
+        p.y = y
+
+    # Box keeps unfilled H_A entries as None, current numpy refuses to solve object arrays
+    for box in objects:
+        box.H_A = np.where(box.H_A == None, 0, box.H_A).astype(np.float64)  # noqa: E711
+        box.H_B = np.zeros(8)
+
+    def run_objects():
+        for box in objects:
+            box._homography()
+        return np.array([box.H for box in objects])
+
+    origins = vertices[boxes[:, 0]].astype(np.float64)
+    quads = moved[boxes]
+
+    def run_batched():
+        return Homography.inverse(origins, size, quads)
+
+    expected = run_objects()
+    actual = run_batched()
+
+    # map sampled points of every box by both inverse homographies and compare in pixels
+    uv = rng.uniform(0, 1, (16, 2))
+    samples = np.concatenate((quads.mean(axis=1)[:, None, :] + (uv - 0.5) * size, np.ones((len(boxes), 16, 1))), axis=2)
+    e = np.einsum('bij,bkj->bki', expected, samples)
+    a = np.einsum('bij,bkj->bki', actual, samples)
+    error = np.abs(e[..., :2]/e[..., 2:] - a[..., :2]/a[..., 2:]).max()
+
+    objects_ips = iterations_per_second(run_objects, args.duration)
+    batched_ips = iterations_per_second(run_batched, args.duration)
+
+    print("boxes: {}".format(len(boxes)))
+    print("solver:     {:10.1f} frames/s".format(objects_ips))
+    print("batched:    {:10.1f} frames/s ({:.1f}x)".format(batched_ips, batched_ips/objects_ips))
+    print("max error:  {:10.2e} px".format(error))
+
+    if error > args.tolerance:
+        print("batched homographies differ from solver by more than {} px".format(args.tolerance))
+        sys.exit(1)
+
+
+def drag(grid, iterations=50):
+    """ Places two handles on the grid, drags one of them and regularizes """
+    rest = grid.lattice.rest
+    anchor = rest[len(rest)//3]
+    handle = rest[2*len(rest)//3]
+
+    grid.create_control_point(0, *anchor)
+    grid.create_control_point(1, *handle)
+    grid.set_control_target(1, handle[0] - 2*grid.BOX_SIZE, handle[1] - grid.BOX_SIZE)
+
+    for _ in range(iterations):
+        grid.regularize()
+
+
+def bench_threads(args):
+    """ Frame time of native projection depending on number of threads, on upscaled image """
+
+    im = Image.open(args.image).convert("RGB")
+    im = im.resize((im.width*args.scale, im.height*args.scale), Image.BICUBIC)
+
+    cw = CWrapper()
+    image = ImageData(cw, im)
+
+    grid = Grid(cw, image)
+    drag(grid)
+
+    threads = args.threads or sorted({1, 2, 4, 8, 16, os.cpu_count()})
+    print("image: {}x{}, boxes: {}, cpus: {}".format(image.width, image.height, grid.lattice.box_count, os.cpu_count()))
+    print("{:>8} {:>12} {:>8}".format("threads", "frame ms", "speedup"))
+
+    def project():
+        grid.invalidate()
+        grid.project()
+
+    base = None
+    for t in threads:
+        cw.threads = t
+        frame = 1 / iterations_per_second(project, args.duration)
+        base = base or frame
+        print("{:>8} {:>12.2f} {:>7.2f}x".format(t, frame*1000, base/frame))
+
+
+def bench_display(args):
+    """
+    Frame time of pushing image data to display,
+    recreating PIL image, PhotoImage and canvas item each frame vs. updating them in place.
+    Without display only the PIL part is measured.
+    """
+
+    im = Image.open(args.image).convert("RGB")
+    im = im.resize((im.width*args.scale, im.height*args.scale), Image.BICUBIC)
+    data = np.array(im)
+
+    try:
+        import tkinter as tk
+        from PIL import ImageTk
+        window = tk.Tk()
+    except Exception as e:  # no display
+        print("Tk not available ({}), measuring PIL only".format(e))
+        window = None
+
+    print("image: {}x{}".format(im.width, im.height))
+
+    if window is None:
+        display = Image.fromarray(data)
+
+        def recreate():
+            Image.fromarray(data)
+
+        def reuse():
+            display.frombytes(data)
+    else:
+        canvas = tk.Canvas(window, width=im.width, height=im.height)
+        canvas.pack()
+
+        state = {"tk": ImageTk.PhotoImage(im)}
+        display = Image.fromarray(data)
+        photo = ImageTk.PhotoImage(display)
+        canvas.create_image((0, 0), image=photo, anchor="nw")
+
+        def recreate():
+            state["tk"] = ImageTk.PhotoImage(Image.fromarray(data))
+            canvas.delete("IMAGE")
+            canvas.create_image((0, 0), image=state["tk"], anchor="nw", tag="IMAGE")
+            window.update()
+
+        def reuse():
+            display.frombytes(data)
+            photo.paste(display)
+            window.update()
+
+    recreate_t = 1 / iterations_per_second(recreate, args.duration)
+    reuse_t = 1 / iterations_per_second(reuse, args.duration)
+
+    print("recreate: {:8.2f} ms".format(recreate_t*1000))
+    print("in place: {:8.2f} ms ({:.1f}x)".format(reuse_t*1000, recreate_t/reuse_t))
+
+    if window is not None:
+        window.destroy()
+
+
+def bench_startup(args):
+    """ Time from loading image to built grid, per asset """
+
+    cw = CWrapper()
+    paths = args.images or sorted(glob.glob(os.path.join("assets", "*")))
+
+    print("{:<20} {:>5} {:>11} {:>7} {:>10} {:>10} {:>10}".format(
+        "image", "scale", "size", "boxes", "decode ms", "mask ms", "grid ms"))
+
+    for path in paths:
+        for scale in args.scales:
+            t0 = time.perf_counter()
+            im = Image.open(path).convert("RGB")
+            if scale != 1:
+                im = im.resize((im.width*scale, im.height*scale), Image.BICUBIC)
+            t1 = time.perf_counter()
+            image = ImageData(cw, im)
+            t2 = time.perf_counter()
+            grid = Grid(cw, image)
+            t3 = time.perf_counter()
+
+            print("{:<20} {:>5} {:>11} {:>7} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                os.path.basename(path), scale, "{}x{}".format(image.width, image.height), grid.lattice.box_count,
+                (t1-t0)*1000, (t2-t1)*1000, (t3-t2)*1000))
+
+
+def bench_mask(args):
+    """ Time of native mask computation, per asset """
+
+    cw = CWrapper()
+    paths = args.images or sorted(glob.glob(os.path.join("assets", "*")))
+
+    print("{:<20} {:>5} {:>11} {:>12} {:>10} {:>10}".format(
+        "image", "scale", "size", "foreground %", "mask ms", "Mpx/s"))
+
+    for path in paths:
+        for scale in args.scales:
+            im = Image.open(path).convert("RGB")
+            if scale != 1:
+                im = im.resize((im.width*scale, im.height*scale), Image.BICUBIC)
+            orig = np.array(im)
+            mask = np.empty((im.height, im.width), dtype=np.bool_)
+
+            times = []
+            for _ in range(args.repeat):
+                mask.fill(True)
+                t = time.perf_counter()
+                cw.mask(mask.ctypes, orig.ctypes, im.width, im.height, 3, args.tolerance)
+                times.append(time.perf_counter() - t)
+            t = float(np.median(times))
+
+            print("{:<20} {:>5} {:>11} {:>12.1f} {:>10.2f} {:>10.1f}".format(
+                os.path.basename(path), scale, "{}x{}".format(im.width, im.height), mask.mean()*100,
+                t*1000, im.width*im.height / t / 1e6))
+
+
+def bench_kernel(args):
+    """ Speed of projection kernels and difference of fixed point bilinear kernel from float one """
+
+    cw = CWrapper(args.threads)
+    paths = args.images or sorted(glob.glob(os.path.join("assets", "*")))
+    modes = (("float", CWrapper.BILINEAR_FLOAT), ("bilinear", CWrapper.BILINEAR), ("nearest", CWrapper.NEAREST))
+
+    print("{:<20} {:>5} {:>10} {:>12} {:>10} {:>9} {:>10}".format(
+        "image", "scale", "float ms", "bilinear ms", "nearest ms", "max diff", "differ %"))
+
+    worst = 0
+    for path in paths:
+        for scale in args.scales:
+            im = Image.open(path).convert("RGB")
+            if scale != 1:
+                im = im.resize((im.width*scale, im.height*scale), Image.BICUBIC)
+            image = ImageData(cw, im)
+            grid = Grid(cw, image)
+            drag(grid)
+
+            times = {}
+            frames = {}
+            for name, quality in modes:
+                grid.quality = quality
+
+                def project():
+                    grid.invalidate()
+                    grid.project()
+
+                times[name] = 1000 / iterations_per_second(project, args.duration)
+                frames[name] = image.data.astype(np.int16)
+
+            diff = np.abs(frames["bilinear"] - frames["float"])
+            worst = max(worst, int(diff.max()))
+            print("{:<20} {:>5} {:>10.2f} {:>12.2f} {:>10.2f} {:>9} {:>10.3f}".format(
+                os.path.basename(path), scale, times["float"], times["bilinear"], times["nearest"],
+                diff.max(), (diff > 0).mean()*100))
+
+    if worst > 1:
+        print("bilinear kernel differs from float one by more than 1")
+        sys.exit(1)
+
+
+def max_rss():
+    """ Peak resident set size of the process in MB, None where it isn't available """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10  # bytes on macOS, kB elsewhere
+
+
+def suite_case(cw, im, box_size, steps, repeat):
+    """
+    Measures one image at one box size
+    :return: dict of metrics, times in ms
+    """
+    grid_type = type("Grid", (Grid,), {"BOX_SIZE": box_size})
+
+    def median(fn):
+        times = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t)
+        return float(np.median(times)) * 1000
+
+    image = ImageData(cw, im)
+
+    # only the mask pass itself, as in bench_mask, without conversion of the image to arrays
+    mask = np.empty_like(image.mask)
+    times = []
+    for _ in range(repeat):
+        mask.fill(True)
+        t = time.perf_counter()
+        cw.mask(mask.ctypes, image.corig, image.width, image.height, image.channels, ImageData.MASK_TOLERANCE)
+        times.append(time.perf_counter() - t)
+    mask_ms = float(np.median(times)) * 1000
+
+    grid_ms = median(lambda: grid_type(cw, image))
+
+    # scripted drag, handle moves by a small step before every iteration, so that grid never converges
+    def drag_steps():
+        grid = grid_type(cw, image)
+        rest = grid.lattice.rest
+        anchor = rest[len(rest)//3]
+        handle = rest[2*len(rest)//3]
+        grid.create_control_point(0, *anchor)
+        grid.create_control_point(1, *handle)
+
+        start = time.perf_counter()
+        for i in range(1, steps+1):
+            grid.set_control_target(1, handle[0] - 2*box_size*i/steps, handle[1] - box_size*i/steps)
+            grid.regularize()
+        return grid, time.perf_counter() - start
+
+    grid, elapsed = min((drag_steps() for _ in range(repeat)), key=lambda r: r[1])
+
+    def project():
+        grid.invalidate()
+        grid.project()
+    project_ms = median(project)
+
+    # memory is measured separately, tracemalloc slows down everything it traces
+    tracemalloc.start()
+    ImageData(cw, im)
+    drag_steps()
+    project()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "boxes": grid.lattice.box_count,
+        "mask_ms": mask_ms,
+        "grid_ms": grid_ms,
+        "regularize_ms": elapsed / steps * 1000,
+        "project_ms": project_ms,
+        "project_mpx_s": image.width * image.height / project_ms / 1000,
+        "peak_mb": peak / 2**20
+    }
+
+
+""" metrics compared against baseline, all of them are better when lower """
+SUITE_METRICS = ("mask_ms", "grid_ms", "regularize_ms", "project_ms", "peak_mb")
+
+
+def bench_suite(args):
+    """
+    Measures mask, grid build, regularization under drag and full projection
+    for every image, scale and box size. Results can be saved as baseline and compared with it later.
+    """
+
+    cw = CWrapper(args.threads)
+    paths = args.images or sorted(glob.glob(os.path.join("assets", "*")))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+
+    print("{:<28} {:>6} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}".format(
+        "case", "boxes", "mask ms", "grid ms", "iter ms", "proj ms", "Mpx/s", "peak MB"))
+
+    results = {}
+    regressions = []
+    for path in paths:
+        source = Image.open(path).convert("RGB")
+        for scale in args.scales:
+            im = source if scale == 1 else source.resize((source.width*scale, source.height*scale), Image.BICUBIC)
+            for box_size in args.box_sizes:
+                case = "{}@{}x/box{}".format(os.path.basename(path), scale, box_size)
+                r = suite_case(cw, im, box_size, args.iterations, args.repeat)
+                results[case] = r
+
+                print("{:<28} {:>6} {:>8.2f} {:>8.2f} {:>8.3f} {:>8.2f} {:>8.1f} {:>8.1f}".format(
+                    case, r["boxes"], r["mask_ms"], r["grid_ms"], r["regularize_ms"], r["project_ms"],
+                    r["project_mpx_s"], r["peak_mb"]))
+
+                if baseline is not None and case in baseline:
+                    for metric in SUITE_METRICS:
+                        ratio = r[metric] / max(baseline[case][metric], 1e-9)
+                        if ratio > 1 + args.threshold:
+                            regressions.append((case, metric, baseline[case][metric], r[metric], ratio))
+
+    rss = max_rss()
+    print("max RSS: {}".format("{:.1f} MB".format(rss) if rss is not None else "n/a"))
+
+    if args.save:
+        meta = {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "threads": cw.threads,
+            "iterations": args.iterations,
+            "max_rss_mb": rss
+        }
+        with open(args.save, "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=4)
+
+    if baseline is not None:
+        if not regressions:
+            print("no regressions over {:.0f} % against {}".format(args.threshold*100, args.compare))
+        for case, metric, old, new, ratio in regressions:
+            print("REGRESSION {:<28} {:<14} {:>10.3f} -> {:>10.3f} ({:+.0f} %)".format(
+                case, metric, old, new, (ratio-1)*100))
+        if regressions:
+            sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of ARAP deformation")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    regularize = commands.add_parser("regularize", help="regularization iterations per second, objects vs lattice")
+    regularize.add_argument("--sizes", type=int, nargs="+", default=[8, 16, 32, 64])
+    regularize.add_argument("--duration", type=float, default=1.0, help="seconds per measurement")
+    regularize.add_argument("--check", type=int, default=5, help="iterations compared for equality")
+    regularize.add_argument("--batch", type=int, default=20, help="native iterations per call")
+    regularize.set_defaults(fn=bench_regularize)
+
+    homography = commands.add_parser("homography", help="accuracy and speed of batched homographies")
+    homography.add_argument("--size", type=int, default=32, help="boxes per side of the lattice")
+    homography.add_argument("--noise", type=float, default=4.0, help="deviation of vertex displacement in px")
+    homography.add_argument("--duration", type=float, default=1.0, help="seconds per measurement")
+    homography.add_argument("--tolerance", type=float, default=1e-6, help="allowed error in px, exits with 1 above it")
+    homography.set_defaults(fn=bench_homography)
+
+    threads = commands.add_parser("threads", help="projection frame time vs. number of threads")
+    threads.add_argument("--image", default="assets/calvin-hobbes.jpg")
+    threads.add_argument("--scale", type=int, default=4, help="upscale factor of the image")
+    threads.add_argument("--threads", type=int, nargs="+")
+    threads.add_argument("--duration", type=float, default=2.0, help="seconds per measurement")
+    threads.set_defaults(fn=bench_threads)
+
+    display = commands.add_parser("display", help="frame time of display update, recreated vs. in place")
+    display.add_argument("--image", default="assets/calvin-hobbes.jpg")
+    display.add_argument("--scale", type=int, default=2, help="upscale factor of the image")
+    display.add_argument("--duration", type=float, default=2.0, help="seconds per measurement")
+    display.set_defaults(fn=bench_display)
+
+    startup = commands.add_parser("startup", help="time of image load, mask computation and grid build")
+    startup.add_argument("--images", nargs="+", help="defaults to all images in assets/")
+    startup.add_argument("--scales", type=int, nargs="+", default=[1, 4], help="upscale factors of images")
+    startup.set_defaults(fn=bench_startup)
+
+    mask = commands.add_parser("mask", help="time of mask flood fill")
+    mask.add_argument("--images", nargs="+", help="defaults to all images in assets/")
+    mask.add_argument("--scales", type=int, nargs="+", default=[1, 4], help="upscale factors of images")
+    mask.add_argument("--tolerance", type=int, default=ImageData.MASK_TOLERANCE)
+    mask.add_argument("--repeat", type=int, default=10, help="measurements per image, median is reported")
+    mask.set_defaults(fn=bench_mask)
+
+    kernel = commands.add_parser("kernel", help="projection kernels, fixed point bilinear checked against float one")
+    kernel.add_argument("--images", nargs="+", help="defaults to all images in assets/")
+    kernel.add_argument("--scales", type=int, nargs="+", default=[1, 2], help="upscale factors of images")
+    kernel.add_argument("--threads", type=int, default=1, help="projection threads")
+    kernel.add_argument("--duration", type=float, default=0.5, help="seconds per measurement")
+    kernel.set_defaults(fn=bench_kernel)
+
+    suite = commands.add_parser("suite", help="all stages over assets, scales and box sizes, with baseline comparison")
+    suite.add_argument("--images", nargs="+", help="defaults to all images in assets/")
+    suite.add_argument("--scales", type=int, nargs="+", default=[1, 2], help="upscale factors of images")
+    suite.add_argument("--box-sizes", type=int, nargs="+", default=[16, 32, 64])
+    suite.add_argument("--iterations", type=int, default=100, help="regularization iterations of the drag")
+    suite.add_argument("--repeat", type=int, default=3, help="measurements per stage, median is reported")
+    suite.add_argument("--threads", type=int, help="projection threads, defaults to number of CPUs")
+    suite.add_argument("--save", help="JSON file to store results as baseline")
+    suite.add_argument("--compare", help="baseline JSON file, exits with 1 if any metric regressed")
+    suite.add_argument("--threshold", type=float, default=0.2, help="allowed relative slowdown against baseline")
+    suite.set_defaults(fn=bench_suite)
+
+    args = parser.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,41 @@
+import queue
 import tkinter as tk
-from datetime import datetime
+
+from PIL import Image
 
 from classes.ImageHelper import ImageHelper
 from classes.Grid import Grid
 from classes.CWrapper import CWrapper
+from classes.Profiler import Profiler
+from classes.Recording import Recording
+from classes.RenderWorker import RenderWorker
 
 
 class Application:
 
-    def __init__(self, path):
+    """ maximal number of regularization iterations between two checks of handle events """
+    ITERATIONS = 20
+
+    """ interval of polling for finished frames in milliseconds """
+    POLL_INTERVAL = 15
+
+    def __init__(self, path, record=None, cache=None, profile=None):
+        """
+        :param path: path to image
+        :param record: path to which handle events are recorded when window closes, nothing is recorded if None
+        :param cache: RigCache object for mask and lattice of the image
+        :param profile: path of JSON or CSV file to which stage durations are dumped when window closes,
+                        they are also shown over the image; nothing is measured if None
+        """
         self._cw = CWrapper()
 
         self._window = tk.Tk()
 
         self._grid = None
         self._image = None
+        self._cache = cache
+        self._rig = None  # cached lattice arrays of the image
+        self._rig_key = None
         self.load_image(path)
 
         self._canvas = tk.Canvas(self._window, width=self._image.width, height=self._image.height)
@@ -22,48 +43,82 @@ class Application:
 
         self._image.canvas = self._canvas
 
+        self._profile_path = profile
+        self._profiler = Profiler(enabled=profile is not None)
+        self._image.profiler = self._profiler
+
         self._active_handle = -1
-        self._loop = None
-        self._t_last = 0
+        self._worker = None
+
+        self._record_path = record
+        self._recording = Recording(path) if record is not None else None
+        self._window.protocol("WM_DELETE_WINDOW", self._close)
 
     def load_image(self, path):
-        self._image = ImageHelper(self._cw, path)
+        if self._cache is None:
+            self._image = ImageHelper(self._cw, path)
+            return
+
+        im = Image.open(path)
+        self._rig_key = self._cache.key(im, Grid.BOX_SIZE, ImageHelper.MASK_TOLERANCE)
+        self._rig = self._cache.get(self._rig_key)
+        self._image = ImageHelper(self._cw, im, self._rig["mask"] if self._rig is not None else None)
 
     def bind(self, event, fn):
         self._canvas.bind(event, fn)
 
     def run(self):
-        self._grid = Grid(self._cw, self._image)
+        self._grid = Grid(self._cw, self._image, rig=self._rig)
+        self._grid.profiler = self._profiler
+        if self._cache is not None and self._rig is None:
+            self._cache.put(self._rig_key, dict(self._grid.rig, mask=self._image.mask))
         self._image.draw()
         self._grid.draw()
 
-        self._run_once()
+        # from now on grid is regularized and projected only by worker
+        self._worker = RenderWorker(self._image, self._grid, self.ITERATIONS)
+        self._worker.start()
+        self._poll()
 
         self._window.mainloop()
 
-    def _run_once(self):
-
-        self._grid.regularize()
-
-        dt = datetime.now()
-        delta = dt.timestamp()-self._t_last
-        if 0 < delta > 0.03:  # 0.03 - 30 FPS
-
-            # dt = datetime.now()
-            # t1 = dt.timestamp()
-
-            self._grid.project()
-
-            #dt = datetime.now()
-            # print(dt.timestamp()-t1)
-
-            self._image.draw()
-            self._grid.draw()
-
-            dt = datetime.now()
-            self._t_last = dt.timestamp()
-
-        self._loop = self._window.after(1, self._run_once)
+    def _poll(self):
+        """ Draws frame finished by worker, if there is new one, and removes handles worker rejected """
+        while True:
+            try:
+                handle_id = self._worker.results.get_nowait()
+            except queue.Empty:
+                break
+            if not self._image.has_handle(handle_id):
+                continue  # already removed by user
+            self._image.remove_handle(handle_id)
+            if self._active_handle == handle_id:
+                self._active_handle = -1
+
+        self._worker.present(self._present)
+        self._window.after(self.POLL_INTERVAL, self._poll)
+
+    def _present(self, frame, lines):
+        self._image.draw(frame)
+
+        # image item is updated in place, canvas work of the frame is drawing of grid lines and overlay
+        with self._profiler.stage("draw"):
+            self._grid.draw(lines)
+            if self._profiler.enabled:
+                self._profiler.overlay(self._canvas)
+
+    def _close(self):
+        if self._worker is not None:
+            self._worker.stop()
+        if self._recording is not None:
+            self._recording.save(self._record_path)
+        if self._profiler.enabled:
+            self._profiler.dump(self._profile_path)
+        self._window.destroy()
+
+    def _record(self, kind, handle_id, e):
+        if self._recording is not None:
+            self._recording.record(kind, handle_id, e.x, e.y)
 
     def select_handle(self, e):
         handle_id = self._image.select_handle(e.x, e.y)
@@ -71,9 +126,8 @@ class Application:
         if handle_id == -1:
             handle_id = self._image.create_handle(e.x, e.y)
             if handle_id != -1:
-                if not self._grid.create_control_point(handle_id, e.x, e.y):
-                    self._image.remove_handle(handle_id)
-                    return False
+                self._worker.create_control_point(handle_id, e.x, e.y)
+                self._record(Recording.CREATE, handle_id, e)
             else:
                 return False
 
@@ -86,10 +140,12 @@ class Application:
     def remove_handle(self, e):
         handle_id = self._image.select_handle(e.x, e.y)
         if handle_id != -1:
-            self._grid.remove_control_point(handle_id)
+            self._worker.remove_control_point(handle_id)
             self._image.remove_handle(handle_id)
+            self._record(Recording.REMOVE, handle_id, e)
 
     def move_handle(self, e):
         if self._active_handle != -1:
             self._image.move_handle(self._active_handle, e.x, e.y)
-            self._grid.set_control_target(self._active_handle, e.x, e.y)
+            self._worker.set_control_target(self._active_handle, e.x, e.y)
+            self._record(Recording.MOVE, self._active_handle, e)
@@ -0,0 +1,106 @@
+import multiprocessing
+import os
+import time
+
+from PIL import Image
+
+from classes.CWrapper import CWrapper
+from classes.Deformer import Deformer
+from classes.RigCache import RigCache
+
+
+_cw = None  # CWrapper of worker process, native library is loaded once per process
+
+
+def _init_worker():
+    global _cw
+    _cw = CWrapper(threads=1)  # parallelism comes from processes, threads would only compete for CPUs
+
+
+def _deform(task):
+    """
+    Deforms single image in worker process
+    :return: (path, output path, iterations, error message or None)
+    """
+    path, output, rig, levels, iterations, cache = task
+    try:
+        deformer = Deformer(path, _cw, levels, RigCache(cache) if cache is not None else None)
+        width, height = deformer.image.width, deformer.image.height
+
+        handles = []
+        for (x, y), _ in rig:
+            handle_id = deformer.add_control_point(x * width, y * height)
+            if handle_id == -1:
+                raise ValueError("handle at {} is outside of the image".format((x, y)))
+            handles.append(handle_id)
+
+        for handle_id, (_, (x, y)) in zip(handles, rig):
+            deformer.set_target(handle_id, x * width, y * height)
+
+        done = deformer.solve(iterations)
+        Image.fromarray(deformer.render()).save(output)
+        return path, output, done, None
+    except Exception as e:
+        return path, output, 0, str(e)
+
+
+class Batch:
+    """
+    Deforms many images by the same handle rig in pool of processes.
+
+    Rig is list of handles, each [[x, y], [x, y]] of its initial and target position
+    relative to image size, so that one rig fits sprites of different sizes.
+    """
+
+    def __init__(self, rig, output, processes=None, levels=None, iterations=1000, cache=None):
+        """
+        :param rig: list of handles as [[x, y], [x, y]] in relative coordinates
+        :param output: output path pattern, {name} is replaced by name of image without extension
+        :param processes: number of worker processes, CPU count if None
+        :param levels: number of lattice levels of multi-resolution solver
+        :param iterations: maximal number of regularization iterations per image
+        :param cache: directory of RigCache shared by workers, nothing is cached if None
+        """
+        self._rig = rig
+        self._output = output
+        self._processes = processes or os.cpu_count() or 1
+        self._levels = levels
+        self._iterations = iterations
+        self._cache = cache
+
+        self.done = 0
+        self.failed = 0
+        self.elapsed = 0
+
+    @property
+    def throughput(self):
+        """ Images per second of the last run """
+        return self.done / self.elapsed if self.elapsed > 0 else 0
+
+    def run(self, paths):
+        """
+        Deforms images, results are generated in order of completion
+        :param paths: list of image paths
+        :return: iterator of (path, output path, iterations, error message or None)
+        """
+        tasks = []
+        for path in paths:
+            name = os.path.splitext(os.path.basename(path))[0]
+            output = self._output.format(name=name)
+            directory = os.path.dirname(output)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tasks.append((path, output, self._rig, self._levels, self._iterations, self._cache))
+
+        self.done = 0
+        self.failed = 0
+        start = time.perf_counter()
+
+        with multiprocessing.Pool(self._processes, _init_worker) as pool:
+            for result in pool.imap_unordered(_deform, tasks):
+                if result[3] is None:
+                    self.done += 1
+                else:
+                    self.failed += 1
+                self.elapsed = time.perf_counter() - start
+                yield result
@@ -1,19 +1,68 @@
 import ctypes as c
+import os
+import sys
 
 
 class CWrapper:
     """ Wrapper for C functions """
 
-    def __init__(self):
-        self._lib = c.cdll.libarap
+    LIBRARY = "libarap.dll" if sys.platform == "win32" else "libarap.so"
 
-    def mask(self, mask, orig, width, height, tolerance):
-        self._lib.compute_mask(mask.data, orig.data, width, height, tolerance)
+    """ sampling of projection, BILINEAR_FLOAT is the slower reference kernel BILINEAR is checked against """
+    NEAREST = 0
+    BILINEAR = 1
+    BILINEAR_FLOAT = 2
 
-    def clear(self, orig, data, width, height):
-        self._lib.clear(orig.data, data.data_as(c.POINTER(c.c_char)), width, height)
+    def __init__(self, threads=None):
+        """
+        :param threads: number of threads used for projection, defaults to number of CPUs
+        """
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self._lib = c.CDLL(os.path.join(root, self.LIBRARY))
 
-    def project(self, homography, mask, orig, data, width, height, corners):
+        self.threads = threads
+
+        # pointers are passed as addresses, they have to be declared not to be truncated to int
+        self._lib.compute_mask.argtypes = [c.c_void_p, c.c_void_p, c.c_int, c.c_int, c.c_int, c.c_int]
+        self._lib.clear.argtypes = [c.c_void_p, c.c_void_p, c.c_int, c.c_int, c.c_int]
+        self._lib.clear_rects.argtypes = [c.c_void_p, c.c_void_p, c.c_int, c.c_int, c.c_int, c.c_void_p, c.c_int]
+        self._lib.project.argtypes = [c.c_void_p, c.c_void_p, c.c_void_p, c.c_void_p, c.c_int, c.c_int, c.c_int,
+                                      c.c_int, c.c_void_p]
+        self._lib.project_all.argtypes = [c.c_void_p, c.c_void_p, c.c_int,
+                                          c.c_void_p, c.c_void_p, c.c_void_p, c.c_int, c.c_int, c.c_int, c.c_int,
+                                          c.POINTER(c.c_int), c.c_int]
+        self._lib.regularize.argtypes = [c.c_void_p, c.c_void_p, c.c_void_p, c.c_void_p, c.c_int,
+                                         c.c_void_p, c.c_void_p, c.c_void_p, c.c_int,
+                                         c.c_void_p, c.c_void_p, c.c_int,
+                                         c.c_int, c.c_double, c.POINTER(c.c_double)]
+        self._lib.regularize.restype = c.c_int
+
+    @property
+    def threads(self):
+        return self._threads
+
+    @threads.setter
+    def threads(self, threads):
+        self._threads = max(1, threads or os.cpu_count() or 1)
+
+    """
+    Image data are packed (height, width, channels) uint8 arrays, channels is 3 for RGB or 4 for RGBA.
+    Cleared pixels of RGBA images are fully transparent.
+    """
+
+    def mask(self, mask, orig, width, height, channels, tolerance):
+        self._lib.compute_mask(mask.data, orig.data, width, height, channels, tolerance)
+
+    def clear(self, orig, data, width, height, channels):
+        self._lib.clear(orig.data, data.data_as(c.POINTER(c.c_char)), width, height, channels)
+
+    def clear_rects(self, orig, data, width, height, channels, rects, count):
+        """
+        :param rects: packed (count, 4) int32 array of [x0, y0, x1, y1) rectangles
+        """
+        self._lib.clear_rects(orig.data, data.data, width, height, channels, rects.data, count)
+
+    def project(self, homography, mask, orig, data, width, height, channels, corners, quality=BILINEAR):
 
         self._lib.project(
             homography.data,
@@ -22,5 +71,61 @@ class CWrapper:
             data.data,
             width,
             height,
+            channels,
+            quality,
             corners.data
         )
+
+    def project_all(self, homographies, corners, count, mask, orig, data, width, height, channels,
+                    quality=BILINEAR, rect=None):
+        """
+        Projects all boxes in one call, split into horizontal bands over worker threads.
+        GIL is released for the duration of the call, as for every function called through CDLL.
+        :param homographies: packed (count, 3, 3) float64 array of inverse homographies
+        :param corners: packed (count, 4, 2) int32 array of box corners
+        :param quality: sampling, one of NEAREST, BILINEAR or BILINEAR_FLOAT
+        :param rect: (x, y, width, height) of the image data covers, whole image if None
+        """
+        if rect is None:
+            rect = (0, 0, width, height)
+
+        self._lib.project_all(
+            homographies.data,
+            corners.data,
+            count,
+            mask.data,
+            orig.data,
+            data.data,
+            width,
+            height,
+            channels,
+            quality,
+            (c.c_int * 4)(*rect),
+            self._threads
+        )
+
+    def regularize(self, pos, rest, weight, link_cnt, vertex_count, boxes, source_centroids, rigid, box_count,
+                   pinned, targets, pinned_count, iterations, tolerance):
+        """
+        Runs up to given number of shape matching iterations, stops once residual is below tolerance
+        :return: (number of iterations done, residual of the last one)
+        """
+        residual = c.c_double(0)
+        done = self._lib.regularize(
+            pos.data,
+            rest.data,
+            weight.data,
+            link_cnt.data,
+            vertex_count,
+            boxes.data,
+            source_centroids.data,
+            rigid.data,
+            box_count,
+            pinned.data,
+            targets.data,
+            pinned_count,
+            iterations,
+            tolerance,
+            c.byref(residual)
+        )
+        return done, residual.value
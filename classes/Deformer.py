@@ -0,0 +1,129 @@
+import numpy as np
+from PIL import Image
+
+from classes.CWrapper import CWrapper
+from classes.Grid import Grid
+from classes.ImageData import ImageData
+from classes.SpatialIndex import SpatialIndex
+
+
+class Deformer:
+    """
+    Headless As Rigid As Possible deformation of an image.
+    Same as Application, but driven by method calls instead of mouse events and without any GUI.
+    """
+
+    """ radius of control point handle, used for hit-testing """
+    HANDLE_RADIUS = 5
+
+    def __init__(self, source, cw=None, levels=None, cache=None):
+        """
+        :param source: path to image or PIL Image
+        :param cw: CWrapper object, new one is created if not given
+        :param levels: number of lattice levels of multi-resolution solver, Grid.LEVELS by default
+        :param cache: RigCache object, mask and lattice are always computed if None
+        """
+        self._cw = cw if cw is not None else CWrapper()
+
+        if cache is None:
+            self._image = ImageData(self._cw, source)
+            self._grid = Grid(self._cw, self._image, levels)
+        else:
+            im = source if isinstance(source, Image.Image) else Image.open(source)
+            key = cache.key(im, Grid.BOX_SIZE, ImageData.MASK_TOLERANCE)
+            rig = cache.get(key)
+
+            self._image = ImageData(self._cw, im, rig["mask"] if rig is not None else None)
+            self._grid = Grid(self._cw, self._image, levels, rig)
+            if rig is None:
+                cache.put(key, dict(self._grid.rig, mask=self._image.mask))
+
+        self._handles = {}  # handle id: current (x, y) position
+        self._next_id = 0
+
+        # handle lookup by position, rebuilt lazily once handles change
+        self._handle_index = SpatialIndex(2*self.HANDLE_RADIUS)
+        self._handle_ids = []
+        self._handle_index_stale = True
+
+    @property
+    def image(self):
+        return self._image
+
+    @property
+    def grid(self):
+        return self._grid
+
+    @property
+    def handles(self):
+        return self._handles
+
+    def add_control_point(self, x, y):
+        """
+        Creates control point at given position
+        :return: Handle ID or -1 if position is outside of grid
+        """
+        handle_id = self._next_id
+        if not self._grid.create_control_point(handle_id, x, y):
+            return -1
+
+        self._next_id += 1
+        self._handles[handle_id] = (x, y)
+        self._handle_index_stale = True
+        return handle_id
+
+    def remove_control_point(self, handle_id):
+        """ Removes control point if exists """
+        if handle_id not in self._handles:
+            return
+
+        self._grid.remove_control_point(handle_id)
+        del self._handles[handle_id]
+        self._handle_index_stale = True
+
+    def set_target(self, handle_id, x, y):
+        """ Move control point to given position if exists """
+        if handle_id not in self._handles:
+            return
+
+        self._grid.set_control_target(handle_id, x, y)
+        self._handles[handle_id] = (x, y)
+        self._handle_index_stale = True
+
+    def select_handle(self, x, y):
+        """
+        Checks if there is handle at given position
+        :return: Handle ID if handle at position exists, -1 otherwise
+        """
+        if self._handle_index_stale:
+            self._handle_ids = list(self._handles.keys())
+            pos = np.array([self._handles[h] for h in self._handle_ids], dtype=np.float64).reshape(-1, 2)
+            self._handle_index.update(np.concatenate((pos - self.HANDLE_RADIUS, pos + self.HANDLE_RADIUS), axis=1))
+            self._handle_index_stale = False
+
+        for i in self._handle_index.query(x, y):
+            hx, hy = self._handles[self._handle_ids[i]]
+            if (hx - x)**2 + (hy - y)**2 <= self.HANDLE_RADIUS**2:
+                return self._handle_ids[i]
+        return -1
+
+    def solve(self, max_iterations=1000, tolerance=None):
+        """
+        Regularizes grid until it converges or max_iterations is reached
+        :param tolerance: maximal vertex displacement considered as converged, Grid.TOLERANCE by default
+        :return: number of iterations done
+        """
+        if tolerance is not None:
+            self._grid.tolerance = tolerance
+
+        start = self._grid.iterations
+        self._grid.regularize(max_iterations)
+        return self._grid.iterations - start
+
+    def render(self):
+        """
+        Projects image to current state of grid
+        :return: image data array, overwritten by next render
+        """
+        self._grid.project()
+        return self._image.data
@@ -0,0 +1,131 @@
+import os
+import queue
+import threading
+
+from PIL import Image
+
+
+class Exporter:
+    """
+    Streams rendered frames to disk in background threads.
+
+    Frames are copied into bounded queue and producer only waits when writers fall behind
+    by more than the queue size.
+
+    Path with format field (e.g. out/{:04d}.png) produces one file per frame, encoded by pool of workers,
+    raw frames (.raw) are plain RGB or RGBA bytes.
+    Path without format field produces single file written by one thread in frame order:
+    animated GIF (.gif) or raw frames concatenated one after another (.raw).
+    Memory stays bounded regardless of clip length for image sequences and raw files,
+    but not for GIF, as Pillow collects all its frames before writing any of them.
+    """
+
+    QUEUE_SIZE = 8
+
+    _STOP = None
+
+    def __init__(self, path, fps=30, workers=None, queue_size=QUEUE_SIZE):
+        """
+        :param path: output path, either pattern formatted by frame number or single .gif/.raw file
+        :param fps: frame rate of animated GIF
+        :param workers: number of encoding threads of image sequence, CPU count if None
+        :param queue_size: maximal number of frames waiting for encoding
+        """
+        self._path = path
+        self._fps = fps
+        self._raw = os.path.splitext(path)[1].lower() == ".raw"
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._queue = queue.Queue(queue_size)
+        self._error = None
+        self._frame = 0
+        self._local = threading.local()  # whether thread has already received its stop mark
+
+        if "{" in path:
+            target = self._write_sequence
+            count = workers or os.cpu_count() or 1
+        elif self._raw:
+            target = self._write_raw
+            count = 1
+        elif path.lower().endswith(".gif"):
+            target = self._write_gif
+            count = 1
+        else:
+            raise ValueError("{} is neither frame pattern nor .gif or .raw file".format(path))
+
+        self._threads = [threading.Thread(target=self._guard, args=(target,), daemon=True) for _ in range(count)]
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def frame_count(self):
+        return self._frame
+
+    def write(self, data):
+        """
+        Queues copy of frame, blocks while queue is full
+        :param data: (height, width, 3) uint8 array
+        """
+        self._check()
+        self._queue.put((self._frame, data.copy()))
+        self._frame += 1
+
+    def close(self):
+        """ Waits until all queued frames are written """
+        for _ in self._threads:
+            self._queue.put(self._STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._check()
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def _guard(self, target):
+        self._local.stopped = False
+        try:
+            target()
+        except Exception as e:
+            self._error = e
+            # keep draining, so producer doesn't block forever on full queue
+            while not self._local.stopped:
+                self._local.stopped = self._queue.get() is self._STOP
+
+    def _frames(self):
+        item = self._queue.get()
+        while item is not self._STOP:
+            yield item
+            item = self._queue.get()
+        self._local.stopped = True
+
+    def _write_sequence(self):
+        for frame, data in self._frames():
+            path = self._path.format(frame)
+            if self._raw:
+                with open(path, "wb") as f:
+                    f.write(data.tobytes())
+            else:
+                Image.fromarray(data).save(path)
+
+    def _write_raw(self):
+        with open(self._path, "wb") as f:
+            for _, data in self._frames():
+                f.write(data.tobytes())
+
+    def _write_gif(self):
+        # Pillow keeps every frame until the file is written, whole clip ends up in memory
+        images = (Image.fromarray(data) for _, data in self._frames())
+        first = next(images, None)
+        if first is not None:
+            first.save(self._path, save_all=True, append_images=images, duration=int(round(1000 / self._fps)), loop=0)
@@ -1,6 +1,11 @@
 import math
-from classes.Point import Point
-from classes.Box import Box
+import numpy as np
+
+from classes import Homography
+from classes.CWrapper import CWrapper
+from classes.Lattice import Lattice
+from classes.Profiler import Profiler
+from classes.SpatialIndex import SpatialIndex
 
 
 class Grid:
@@ -13,200 +18,517 @@ class Grid:
     BOX_SIZE = 32
     CONTROL_WEIGHT = 100000
 
+    """ number of lattice levels of multi-resolution solver, 1 solves only the finest lattice """
+    LEVELS = 1
+
+    """ maximal vertex displacement between two regularizations considered as converged """
+    TOLERANCE = 0.01
+
+    """ minimal corner displacement since last projection for box to be projected again """
+    DIRTY_THRESHOLD = 0.1
+
+    """ sampling of projection, one of CWrapper.NEAREST, BILINEAR or BILINEAR_FLOAT """
+    QUALITY = CWrapper.BILINEAR
+
     iter = 0
     id = None
 
-    def __init__(self, cw, image):
+    def __init__(self, cw, image, levels=None, rig=None):
+        """
+        :param cw: CWrapper object
+        :param image: ImageData object
+        :param levels: number of lattice levels, coarse levels are solved first after change of controls
+        :param rig: precomputed lattice arrays of the same image as returned by rig, built from image mask if None
+        """
 
         self.visible = False
+        self.profiler = Profiler(enabled=False)  # replaced by enabled one to measure stages
+        self._quality = self.QUALITY
+
+        self.tolerance = self.TOLERANCE
+        self.iterations = 0  # regularizations done since the last change of controls
+        self.residual = 0  # maximal vertex displacement in the last regularization
+        self._converged = True
 
         self.cw = cw
 
         self._image = image
-        self._points = {}
-        self._boxes = []
 
-        immask = self._image.mask
+        """
+        Lattice nodes, node (col, row) lies at origin + BOX_SIZE * (col, row)
+        index: (rows+1, cols+1) array of vertex indices of nodes, -1 for nodes without any box
+        """
+        self._origin = np.zeros(2, dtype=np.int64)
+        self._occupied = np.zeros((0, 0), dtype=np.bool_)
+        self._index = None
+        if rig is not None:
+            self._origin = np.asarray(rig["origin"])
+            self._occupied = rig["occupied"]
+            self._index = rig["index"]
+            vertices, boxes = rig["vertices"], rig["boxes"]
+        else:
+            vertices, boxes = self._build(self._image.mask)
+
+        self._lattice = Lattice(vertices, boxes, cw)
 
-        # find borders of image
-        top = self._border(immask)
-        btm = self._image.height - self._border(immask[::-1])
-        lft = self._border(immask.T)
-        rgt = self._image.width - self._border(immask.T[::-1])
+        self._coarse = []
+        self._coarse_pending = False  # coarse levels are solved on next regularization
+        self._coarsen(levels if levels is not None else self.LEVELS)
 
-        width = rgt-lft
-        height = btm-top
+        self._projected = None  # box corners at the time of their last projection, None forces full projection
 
-        box_count = (int(math.ceil(width/self.BOX_SIZE)), int(math.ceil(height/self.BOX_SIZE)))
-        box_x = lft - int((box_count[0] * self.BOX_SIZE - width) / 2)
-        box_y = top - int((box_count[1] * self.BOX_SIZE - height) / 2)
-
-        # create Boxes over image
-        for y in range(box_y, btm, self.BOX_SIZE):
-            for x in range(box_x, rgt, self.BOX_SIZE):
-                if -1 != self._border(immask[y:y+self.BOX_SIZE:1, x:x+self.BOX_SIZE:1]):
-                    if x < 0 or x + self.BOX_SIZE > self._image.width \
-                            or y < 0 or y + self.BOX_SIZE > self._image.height:
-                        continue
-
-                    self._boxes.append(
-                        Box(
-                            self.cw,
-                            self._add_point(x, y),
-                            self._add_point(x+self.BOX_SIZE, y),
-                            self._add_point(x+self.BOX_SIZE, y+self.BOX_SIZE),
-                            self._add_point(x, y+self.BOX_SIZE)
-                        )
-                    )
+        # box lookup by position, rebuilt lazily once the mesh moves
+        self._box_index = SpatialIndex(self.BOX_SIZE)
+        self._box_index_stale = True
 
         """
         Control points setup
         key: Handle ID from ImageHelper
-        item: [point ref, (x, y target coordinates), (x, y offset of grid Point from handle)]
+        item: [vertex index, (x, y target coordinates), (x, y offset of grid vertex from handle)]
         """
         self._controls = {}
 
-    def _border(self, mask):
-        """
-        Finds the first row of the mask which contains foreground pixel.
-        :return: row number in which the first foreground pixel was found, -1 if all pixels are empty
-        """
-        fg = 0
-        stop = False
-        for row in mask:
-            i = 0
-            for sign in row:
-                if sign:
-                    stop = True
-                    break
-                i += 1
-            if stop:
-                break
-            fg += 1
-
-        if not stop:
-            return -1
-        return fg
+    def _build(self, immask):
+        """
+        Lays boxes over foreground of the image mask
+        :return: (vertices, boxes) arrays for Lattice
+        """
+        size = self.BOX_SIZE
+        self._index = np.full((1, 1), -1, dtype=np.int32)
+        self._occupied = np.zeros((0, 0), dtype=np.bool_)
+
+        # find borders of image, reduced by bands of rows like occupancy below
+        bands = [immask[y:y+size] for y in range(0, immask.shape[0], size)]
+        rows = np.flatnonzero(np.concatenate([band.any(axis=1) for band in bands]))
+        cols = np.flatnonzero(np.logical_or.reduce([band.any(axis=0) for band in bands]))
+        if len(rows) == 0:
+            return np.empty((0, 2)), np.empty((0, 4), dtype=np.int32)
+
+        top, btm = rows[0], rows[-1] + 1
+        lft, rgt = cols[0], cols[-1] + 1
 
-    def _add_point(self, x, y):
+        width = rgt-lft
+        height = btm-top
+
+        box_count = (int(math.ceil(width/size)), int(math.ceil(height/size)))
+        box_x = lft - int((box_count[0] * size - width) / 2)
+        box_y = top - int((box_count[1] * size - height) / 2)
+
+        # only boxes lying completely inside of the image are considered
+        xs = np.arange(box_x, rgt, size)
+        ys = np.arange(box_y, btm, size)
+        xs = xs[(xs >= 0) & (xs + size <= self._image.width)]
+        ys = ys[(ys >= 0) & (ys + size <= self._image.height)]
+        if len(xs) == 0 or len(ys) == 0:
+            return np.empty((0, 2)), np.empty((0, 4), dtype=np.int32)
+
+        # box is created if it contains any foreground pixel,
+        # mask is reduced by rows of boxes so that memory-mapped mask is never copied whole
+        occupied = np.empty((len(ys), len(xs)), dtype=np.bool_)
+        for i, y in enumerate(ys):
+            band = immask[y:y+size, xs[0]:xs[-1]+size]
+            occupied[i] = band.reshape(size, len(xs), size).any(axis=(0, 2))
+
+        self._origin = np.array([xs[0], ys[0]])
+        self._occupied = occupied
+
+        vertices, boxes, self._index = self._nodes(occupied, size)
+        return vertices, boxes
+
+    def _nodes(self, occupied, size):
         """
-        Creates new Point at given coordinate if it does not already exist
-        :return: Point at given coordinates
+        Creates lattice of occupied boxes
+        :param occupied: (rows, cols) boolean array of boxes to create
+        :param size: size of box
+        :return: (vertices, boxes, index) where index is (rows+1, cols+1) array of vertex indices of nodes
         """
-        if y in self._points:
-            if x not in self._points[y]:
-                self._points[y][x] = Point(x, y)
-        else:
-            self._points[y] = {}
-            self._points[y][x] = Point(x, y)
 
-        return self._points[y][x]
+        # lattice nodes used by any box, indexed in row-major order
+        used = np.zeros((occupied.shape[0]+1, occupied.shape[1]+1), dtype=np.bool_)
+        used[:-1, :-1] |= occupied
+        used[:-1, 1:] |= occupied
+        used[1:, 1:] |= occupied
+        used[1:, :-1] |= occupied
+
+        index = np.where(used, used.cumsum().reshape(used.shape) - 1, -1).astype(np.int32)
 
-    def _reset_weights(self):
+        node_rows, node_cols = np.nonzero(used)
+        vertices = np.stack((node_cols, node_rows), axis=1) * size + self._origin
+
+        box_rows, box_cols = np.nonzero(occupied)
+        boxes = np.stack((
+            index[box_rows, box_cols],
+            index[box_rows, box_cols+1],
+            index[box_rows+1, box_cols+1],
+            index[box_rows+1, box_cols]
+        ), axis=1)
+
+        return vertices, boxes, index
+
+    def _coarsen(self, levels):
         """
-        Set weight of each vertex in grid to 1.
+        Builds coarser lattices, each with twice as large boxes as the previous one.
+        Each coarse level keeps its lattice, node index, box size and
+        prolongation to the next finer level, i.e. coarse box and bilinear coordinates of every finer vertex.
         """
-        for y in self._points:
-            for x in self._points[y]:
-                self._points[y][x].weight = 1
+        self._coarse = []
+
+        occupied = self._occupied
+        index = self._index
+        size = self.BOX_SIZE
+        for _ in range(1, levels):
+            rows, cols = occupied.shape
+            padded = np.zeros((rows + rows % 2, cols + cols % 2), dtype=np.bool_)
+            padded[:rows, :cols] = occupied
+            coarse = padded.reshape(padded.shape[0]//2, 2, padded.shape[1]//2, 2).any(axis=(1, 3))
+
+            vertices, boxes, coarse_index = self._nodes(coarse, 2*size)
+            lattice = Lattice(vertices, boxes, self.cw)
+
+            # box of every finer vertex in coarse lattice, some existing one of those it lies in
+            node_rows, node_cols = np.nonzero(index >= 0)
+            box = np.full(len(node_rows), -1, dtype=np.int64)
+            box_of = np.full(coarse.shape, -1, dtype=np.int64)
+            box_of[coarse] = np.arange(len(boxes))
+            for dr in (0, 1):
+                for dc in (0, 1):
+                    r = np.minimum((node_rows - dr) // 2, coarse.shape[0]-1)
+                    c = np.minimum((node_cols - dc) // 2, coarse.shape[1]-1)
+                    candidate = np.where((r >= 0) & (c >= 0), box_of[np.maximum(r, 0), np.maximum(c, 0)], -1)
+                    box = np.where(box == -1, candidate, box)
+
+            corner = lattice.rest[lattice.boxes[box, 0]]
+            fine = np.stack((node_cols, node_rows), axis=1) * size + self._origin
+            uv = (fine - corner) / (2*size)
+
+            self._coarse.append((lattice, coarse_index, 2*size, (box, uv)))
+
+            occupied = coarse
+            index = coarse_index
+            size *= 2
+
+    @property
+    def lattice(self):
+        return self._lattice
+
+    @property
+    def quality(self):
+        return self._quality
+
+    @quality.setter
+    def quality(self, quality):
+        """ Changes sampling of projection, whole image is projected again on next projection """
+        self._quality = quality
+        self.invalidate()
+
+    @property
+    def rig(self):
+        """ Arrays describing lattice of the image, see RigCache """
+        return {
+            "origin": self._origin,
+            "occupied": self._occupied,
+            "index": self._index,
+            "vertices": self._lattice.rest,
+            "boxes": self._lattice.boxes
+        }
+
+    @property
+    def converged(self):
+        """ Whether grid has settled, i.e. further regularization would not move any vertex over tolerance """
+        return self._converged
+
+    def _wake(self):
+        """ Resume regularization after change of controls """
+        self._converged = False
+        self._coarse_pending = len(self._coarse) != 0
+        self.iterations = 0
 
     def _update_weights(self):
         """
         Update weights of grid's vertices, respecting the structure of grid, i.e. run BFS from all control points.
+        Weight decreases by BOX_SIZE**2 with each box edge from the nearest control point.
         """
-        self._reset_weights()
-
-        queue = []
-        for handle_id in self._controls:
-            control_x = self._controls[handle_id][0].ix
-            control_y = self._controls[handle_id][0].iy
-            weight = self.CONTROL_WEIGHT
-
-            queue.append((control_x, control_y, weight))
-
-        size = self.BOX_SIZE
-        d = [(-size, 0), (size, 0), (0, -size), (0, size)]
+        sources = [control[0] for control in self._controls.values()]
+        self._lattice.propagate_weights(sources, self.CONTROL_WEIGHT, self.BOX_SIZE**2)
+        self._lattice.compute_source_centroids()
 
-        while len(queue) != 0:
-            x, y, w = queue.pop()
+        for lattice, index, size, _ in self._coarse:
+            pinned, _ = self._coarse_controls(lattice, index, size)
+            lattice.propagate_weights(pinned, self.CONTROL_WEIGHT, size**2)
+            lattice.compute_source_centroids()
 
-            if self._points[y][x].weight < w:
-                continue
+    def _coarse_controls(self, lattice, index, size):
+        """
+        Maps control points to the nearest existing nodes of coarse lattice,
+        targets are shifted by offset of the coarse node from the control vertex
+        :return: (pinned vertices, targets)
+        """
+        pinned = []
+        targets = []
+        for control in self._controls.values():
+            rest = self._lattice.rest[control[0]]
+            col, row = (rest - self._origin) / size
+
+            best = None
+            for r in {int(np.floor(row)), int(np.ceil(row))}:
+                for c in {int(np.floor(col)), int(np.ceil(col))}:
+                    if 0 <= r < index.shape[0] and 0 <= c < index.shape[1] and index[r, c] != -1:
+                        dist = abs(r - row) + abs(c - col)
+                        if best is None or dist < best[0]:
+                            best = (dist, index[r, c])
+
+            if best is not None:
+                offset = lattice.rest[best[1]] - rest
+                pinned.append(best[1])
+                targets.append((control[1][0] + offset[0], control[1][1] + offset[1]))
+
+        return pinned, targets
+
+    def box_at(self, x, y):
+        """
+        Finds box whose bounding box contains given position, first one in grid order if there are more
+        :return: box index or -1
+        """
+        if self._box_index_stale:
+            corners = self._lattice.corners()
+            self._box_index.update(np.concatenate((corners.min(axis=1), corners.max(axis=1)), axis=1))
+            self._box_index_stale = False
 
-            self._points[y][x].weight = self._points[y][x].weight
+        boxes = self._box_index.query(x, y)
+        return boxes[0] if len(boxes) != 0 else -1
 
-            for dx, dy in d:
-                nbr_x = x+dx
-                nbr_y = y+dy
-                nbr_w = w-self.BOX_SIZE**2
-                if nbr_w > 1 \
-                        and nbr_y in self._points and nbr_x in self._points[nbr_y]:
-                    queue.append((nbr_x, nbr_y, nbr_w))
+    def vertex_at(self, x, y):
+        """
+        Finds vertex closest to given position among corners of the box at that position
+        :return: vertex index or -1 if position is outside of grid
+        """
+        box = self.box_at(x, y)
+        if box == -1:
+            return -1
 
-        for box in self._boxes:
-            box.compute_source_centroid()
+        corners = self._lattice.pos[self._lattice.boxes[box]]
+        dist = np.abs(corners[:, 0] - x) + np.abs(corners[:, 1] - y)
+        return self._lattice.boxes[box, np.argmin(dist)]
 
     def create_control_point(self, handle_id, x, y):
         """
         Creates control point if position is inside of grid and updates weights of grid's vertices.
         :return: boolean
         """
-        for box in self._boxes:
-            if box.has_point(x, y):
-
-                control = box.get_closest_boundary(x, y)
-                control.weight = self.CONTROL_WEIGHT
+        control = self.vertex_at(x, y)
+        if control == -1:
+            return False
 
-                self._controls[handle_id] = [control, (control.x, control.y), (control.x - x, control.y - y)]
+        cx, cy = self._lattice.pos[control]
+        self._controls[handle_id] = [control, (cx, cy), (cx - x, cy - y)]
 
-                self._update_weights()
-                return True
-
-        return False
+        self._update_weights()
+        self._wake()
+        return True
 
     def remove_control_point(self, handle_id):
         if handle_id in self._controls:
             del self._controls[handle_id]
             self._update_weights()
+            self._wake()
 
     def set_control_target(self, handle_id, x, y):
         """ Change target of control point if exists """
+        if handle_id not in self._controls:
+            return
+
         dx, dy = self._controls[handle_id][2]
-        self._controls[handle_id][1] = (x+dx, y+dy)
+        target = (x+dx, y+dy)
+        if target != self._controls[handle_id][1]:
+            self._controls[handle_id][1] = target
+            self._wake()
 
-    def draw(self):
+    def lines(self):
+        """
+        Snapshot of grid to be drawn later, possibly by another thread
+        :return: (rigid, boundary) lists of corners of boxes, empty if grid isn't visible
+        """
+        if not self.visible:
+            return [], []
+        return self._lattice.rigid.tolist(), self._lattice.corners().tolist()
+
+    def draw(self, lines=None):
         """
         Visualize grid
+        :param lines: snapshot from lines(), current state of grid if None
         """
         self._image.canvas.delete("GRID")
 
-        if self.visible:
-            for box in self._boxes:
-                box.draw(self._image.canvas, True)
+        if lines is None:
+            lines = self.lines()
+
+        canvas = self._image.canvas
+        for rigid, boundary in zip(*lines):
+            for i in range(0, 4):
+                canvas.create_line(rigid[i], rigid[(i+1) % 4], fill="blue", tag="GRID")
+            for i in range(0, 4):
+                canvas.create_line(boundary[i], boundary[(i+1) % 4], fill="red", tag="GRID")
+
+    def regularize(self, iterations=1):
+        """
+        Regularize grid to preserve As Rigid As Possible deformation.
+        Does nothing once grid has converged, until controls change.
+        :param iterations: maximal number of iterations, fewer are done if grid converges
+        :return: boolean, whether regularization was done
+        """
+        if self._converged:
+            return False
+
+        with self.profiler.stage("regularize"):
+            if self._coarse_pending:
+                self._solve_coarse(iterations)
+
+            controls = list(self._controls.values())
+            pinned = [control[0] for control in controls]
+            targets = [control[1] for control in controls]
+
+            done, self.residual = self._lattice.regularize(pinned, targets, iterations, self.tolerance)
+        self.iterations += done
+        self._converged = self.residual < self.tolerance
+        self._box_index_stale = True
+        return True
 
-    def regularize(self):
+    def _solve_coarse(self, iterations):
         """
-        Regularize grid to preserve As Rigid As Possible deformation
+        Solves coarse levels from the coarsest one, each solution is prolongated to the next finer level as initial guess
         """
-        for handle_id in self._controls:
-            control = self._controls[handle_id]
-            control[0].x = control[1][0]
-            control[0].y = control[1][1]
+        self._coarse_pending = False
 
-        for box in self._boxes:
-            box.fit()
+        for level in range(len(self._coarse)-1, -1, -1):
+            lattice, index, size, (box, uv) = self._coarse[level]
 
-        for y in self._points:
-            for x in self._points[y]:
-                self._points[y][x].average_linked()
+            pinned, targets = self._coarse_controls(lattice, index, size)
+            lattice.regularize(pinned, targets, iterations, self.tolerance)
+
+            finer = self._coarse[level-1][0] if level > 0 else self._lattice
+
+            corners = lattice.pos[lattice.boxes[box]]
+            u = uv[:, 0, None]
+            v = uv[:, 1, None]
+            finer.pos[:] = (1-u)*(1-v)*corners[:, 0] + u*(1-v)*corners[:, 1] \
+                + u*v*corners[:, 2] + (1-u)*v*corners[:, 3]
+
+    def invalidate(self):
+        """ Forces full projection next time """
+        self._projected = None
+
+    def _dirty_boxes(self, boundary):
+        """
+        Finds boxes which moved since their last projection and clears their old and new footprints.
+        :return: indices of boxes which have to be projected again, in grid order
+        """
+
+        moved = np.abs(boundary - self._projected).max(axis=(1, 2)) > self.DIRTY_THRESHOLD
+        if not moved.any():
+            return np.empty(0, dtype=np.intp)
+
+        old = np.rint(self._projected[moved])
+        new = np.rint(boundary[moved])
+        rects = np.concatenate((
+            np.concatenate((old.min(axis=1), old.max(axis=1) + 1), axis=1),
+            np.concatenate((new.min(axis=1), new.max(axis=1) + 1), axis=1)
+        )).astype(np.int32)
+
+        self.cw.clear_rects(self._image.corig, self._image.cdata, self._image.width, self._image.height,
+                            self._image.channels, rects.ctypes, len(rects))
+
+        # mark cleared cells of coarse cell map, then find all boxes overlapping marked cells
+        size = self.BOX_SIZE
+        cols = -(-self._image.width // size)
+        rows = -(-self._image.height // size)
+
+        cells = np.clip(rects // size, 0, [cols-1, rows-1, cols-1, rows-1])
+        cleared = np.zeros((rows+1, cols+1), dtype=np.int32)
+        np.add.at(cleared, (cells[:, 1], cells[:, 0]), 1)
+        np.add.at(cleared, (cells[:, 1], cells[:, 2]+1), -1)
+        np.add.at(cleared, (cells[:, 3]+1, cells[:, 0]), -1)
+        np.add.at(cleared, (cells[:, 3]+1, cells[:, 2]+1), 1)
+        cleared = cleared.cumsum(axis=0).cumsum(axis=1)[:rows, :cols] > 0
+
+        # summed area table for queries of box bounding boxes
+        table = np.zeros((rows+1, cols+1), dtype=np.int32)
+        table[1:, 1:] = cleared.cumsum(axis=0).cumsum(axis=1)
+
+        bbox = np.rint(boundary)
+        lo = np.clip(bbox.min(axis=1) // size, 0, [cols-1, rows-1]).astype(np.intp)
+        hi = np.clip(bbox.max(axis=1) // size, 0, [cols-1, rows-1]).astype(np.intp) + 1
+
+        hits = table[hi[:, 1], hi[:, 0]] - table[lo[:, 1], hi[:, 0]] - table[hi[:, 1], lo[:, 0]] + table[lo[:, 1], lo[:, 0]]
+        return np.flatnonzero(hits > 0)
+
+    def project_tiles(self, tile_size, fn):
+        """
+        Projects whole image tile by tile into buffer of single tile, so that output never has to fit into memory.
+        Image data aren't touched.
+        :param tile_size: size of square tile, tiles at right and bottom border are smaller
+        :param fn: called as fn(x, y, data) with position of tile and its (height, width, channels) data,
+                   data is overwritten by the next tile
+        """
+        image = self._image
+        lattice = self._lattice
+        boundary = lattice.corners()
+
+        origins = lattice.rest[lattice.boxes[:, 0]]
+        homographies = Homography.inverse(origins, self.BOX_SIZE, boundary)
+        corners = np.rint(boundary).astype(np.int32)
+        lo = corners.min(axis=1)
+        hi = corners.max(axis=1)
+
+        buffer = np.empty(tile_size * tile_size * image.channels, dtype=np.uint8)
+        for y in range(0, image.height, tile_size):
+            h = min(tile_size, image.height - y)
+            row = np.flatnonzero((hi[:, 1] >= y) & (lo[:, 1] < y + h))
+
+            for x in range(0, image.width, tile_size):
+                w = min(tile_size, image.width - x)
+                data = buffer[:h * w * image.channels].reshape(h, w, image.channels)
+
+                with self.profiler.stage("clear"):
+                    self.cw.clear(image.corig, data.ctypes, w, h, image.channels)
+
+                boxes = row[(hi[row, 0] >= x) & (lo[row, 0] < x + w)]
+                if len(boxes) != 0:
+                    tile_homographies = homographies[boxes]
+                    tile_corners = corners[boxes]
+                    with self.profiler.stage("project"):
+                        self.cw.project_all(tile_homographies.ctypes, tile_corners.ctypes, len(boxes),
+                                            image.cmask, image.corig, data.ctypes,
+                                            image.width, image.height, image.channels, self._quality, (x, y, w, h))
+                fn(x, y, data)
 
     def project(self):
         """
         Create projection of current state
-        Image data are properly updated
+        Image data are properly updated.
+        Only boxes which moved since last projection and boxes overlapping their footprints are projected.
         """
 
-        self.cw.clear(self._image.corig, self._image.cdata, self._image.width, self._image.height)
-
-        for box in self._boxes:
-            box.project(self._image)
+        lattice = self._lattice
+        boundary = lattice.corners()
+
+        with self.profiler.stage("clear"):
+            if self._projected is None:
+                self.cw.clear(self._image.corig, self._image.cdata, self._image.width, self._image.height,
+                              self._image.channels)
+                self._projected = boundary.copy()
+                boxes = np.arange(lattice.box_count)
+            else:
+                boxes = self._dirty_boxes(boundary)
+                if len(boxes) == 0:
+                    return
+                self._projected[boxes] = boundary[boxes]
+
+        with self.profiler.stage("homography"):
+            origins = lattice.rest[lattice.boxes[boxes, 0]]
+            homographies = Homography.inverse(origins, self.BOX_SIZE, boundary[boxes])
+            corners = np.rint(boundary[boxes]).astype(np.int32)
+
+        with self.profiler.stage("project"):
+            self.cw.project_all(homographies.ctypes, corners.ctypes, len(boxes),
+                                self._image.cmask, self._image.corig, self._image.cdata,
+                                self._image.width, self._image.height, self._image.channels, self._quality)
@@ -0,0 +1,70 @@
+import numpy as np
+
+
+def square_to_quad(quads):
+    """
+    Computes homographies mapping unit square to given quads in closed form,
+    see Heckbert: Fundamentals of Texture Mapping and Image Warping, 1989
+    :param quads: (M, 4, 2) array of quad corners in order top-left, top-right, bottom-right, bottom-left
+    :return: (M, 3, 3) array of homographies
+    """
+
+    x0, x1, x2, x3 = np.moveaxis(quads[..., 0], -1, 0)
+    y0, y1, y2, y3 = np.moveaxis(quads[..., 1], -1, 0)
+
+    dx1 = x1 - x2
+    dx2 = x3 - x2
+    dx3 = x0 - x1 + x2 - x3
+    dy1 = y1 - y2
+    dy2 = y3 - y2
+    dy3 = y0 - y1 + y2 - y3
+
+    det = dx1*dy2 - dx2*dy1
+    g = (dx3*dy2 - dx2*dy3) / det
+    h = (dx1*dy3 - dx3*dy1) / det
+
+    H = np.empty(quads.shape[:-2] + (3, 3))
+    H[..., 0, 0] = x1 - x0 + g*x1
+    H[..., 0, 1] = x3 - x0 + h*x3
+    H[..., 0, 2] = x0
+    H[..., 1, 0] = y1 - y0 + g*y1
+    H[..., 1, 1] = y3 - y0 + h*y3
+    H[..., 1, 2] = y0
+    H[..., 2, 0] = g
+    H[..., 2, 1] = h
+    H[..., 2, 2] = 1
+    return H
+
+
+def invert(H):
+    """
+    Inverts stack of 3x3 matrices via adjugate
+    :param H: (M, 3, 3) array
+    :return: (M, 3, 3) array
+    """
+
+    r0 = H[..., 0, :]
+    r1 = H[..., 1, :]
+    r2 = H[..., 2, :]
+
+    adj = np.stack((np.cross(r1, r2), np.cross(r2, r0), np.cross(r0, r1)), axis=-1)
+    det = np.einsum('...i,...i', r0, adj[..., :, 0])
+    return adj / det[..., None, None]
+
+
+def inverse(origins, size, quads):
+    """
+    Computes inverse homographies of all boxes at once.
+    Source of each box is axis aligned square, target is its current boundary.
+    :param origins: (M, 2) array of top-left corners of source squares
+    :param size: side of source squares
+    :param quads: (M, 4, 2) array of current box corners
+    :return: (M, 3, 3) array of homographies mapping current boundary to source square
+    """
+
+    H = invert(square_to_quad(quads))
+
+    # unit square to source square
+    H[..., 0, :] = H[..., 0, :]*size + origins[:, 0, None]*H[..., 2, :]
+    H[..., 1, :] = H[..., 1, :]*size + origins[:, 1, None]*H[..., 2, :]
+    return H
@@ -0,0 +1,92 @@
+import numpy as np
+from PIL import Image
+
+
+class ImageData:
+    """
+    Holds data of loaded image and its mask, without any dependency on GUI.
+    Image is converted to RGB, or to RGBA if it has transparency.
+    Mask of image with alpha channel is its opaque part, otherwise background is flood filled from borders.
+    """
+
+    """ tolerance of background color when computing mask """
+    MASK_TOLERANCE = 10
+
+    def __init__(self, cw, source, mask=None):
+        """
+        :param cw: CWrapper object
+        :param source: path to image or PIL Image
+        :param mask: precomputed mask of the image, computed if None
+        """
+        self.cw = cw
+
+        im = source if isinstance(source, Image.Image) else Image.open(source)
+        mode = "RGBA" if im.mode in ("RGBA", "LA", "PA") or "transparency" in im.info else "RGB"
+        self._im_obj = im if im.mode == mode else im.convert(mode)
+
+        self._size = self._im_obj.size
+
+        self._orig = np.array(self._im_obj)  # original data of the image immediately after load
+        self._data = np.array(self._im_obj)  # current data of the image to draw
+
+        self._mask = mask
+        if mask is None:
+            self._compute_mask()
+
+    @property
+    def width(self):
+        return self._size[0]
+
+    @property
+    def height(self):
+        return self._size[1]
+
+    @property
+    def channels(self):
+        return self._orig.shape[2]
+
+    @property
+    def mask(self):
+        return self._mask
+
+    @property
+    def data(self):
+        """
+        :return: current data of the image, overwritten by next projection
+        """
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        """ Replaces buffer of current data by another one of the same shape """
+        self._data = data
+
+    @property
+    def cmask(self):
+        """
+        :return: Object for communicating with C interface for image mask
+        """
+        return self._mask.ctypes
+
+    @property
+    def cdata(self):
+        """
+        :return: Object for communicating with C interface for current image data
+        """
+        return self._data.ctypes
+
+    @property
+    def corig(self):
+        """
+        :return: Object for communicating with C interface for data of original image
+        """
+        return self._orig.ctypes
+
+    def _compute_mask(self):
+        """ Compute mask of image - foreground is True, background is False """
+        if self.channels == 4:
+            self._mask = self._orig[:, :, 3] > 0
+            return
+
+        self._mask = np.full((self.height, self.width), True, dtype=np.bool_)
+        self.cw.mask(self.cmask, self.corig, self.width, self.height, self.channels, self.MASK_TOLERANCE)
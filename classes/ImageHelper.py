@@ -1,8 +1,10 @@
-import numpy as np
 from PIL import Image, ImageTk
 
+from classes.ImageData import ImageData
+from classes.Profiler import Profiler
 
-class ImageHelper:
+
+class ImageHelper(ImageData):
     """
     Manipulates directly with image.
     Ensures it's loading, updating and redrawing as well as provides info about loaded image.
@@ -11,22 +13,17 @@ class ImageHelper:
     """ radius of visual representation of control point """
     HANDLE_RADIUS = 5
 
-    def __init__(self, cw, path):
-        self.cw = cw
-        self._canvas = None
+    def __init__(self, cw, path, mask=None):
+        super().__init__(cw, path, mask)
 
-        self._im_obj = Image.open(path)
-        self._tk_obj = ImageTk.PhotoImage(self._im_obj)  # keeping reference for image to load
+        self._canvas = None
+        self.profiler = Profiler(enabled=False)  # replaced by enabled one to measure stages
+        self._display_obj = None  # PIL image of displayed data
+        self._tk_obj = None  # keeping reference for image to load, created on first draw
+        self._item = None  # canvas item of the image
 
-        self._size = self._im_obj.size
         self._pos = (self.width/2, self.height/2)
 
-        self._orig = np.array(self._im_obj)  # original data of the image immediately after load
-        self._data = np.array(self._im_obj)  # current data of the image to draw
-
-        self._mask = None
-        self._compute_mask()
-
         self._handles = set()
 
     @property
@@ -37,55 +34,30 @@ class ImageHelper:
     def canvas(self, canvas):
         self._canvas = canvas
 
-    @property
-    def width(self):
-        return self._size[0]
-
-    @property
-    def height(self):
-        return self._size[1]
-
-    @property
-    def mask(self):
-        return self._mask
-
-    @property
-    def cmask(self):
+    def _update(self, data):
         """
-        :return: Object for communicating with C interface for image mask
+        Update displayed image from given data.
+        PIL and Tk images are created once and then updated in place.
+        PIL image has storage of its own, fromarray would share memory with data for RGBA.
         """
-        return self._mask.ctypes
-
-    @property
-    def cdata(self):
+        if self._tk_obj is None:
+            self._display_obj = Image.new(self._im_obj.mode, self._im_obj.size)
+            self._display_obj.frombytes(data)
+            self._tk_obj = ImageTk.PhotoImage(self._display_obj)  # need to keep reference for image to load
+        else:
+            self._display_obj.frombytes(data)
+            self._tk_obj.paste(self._display_obj)
+
+    def draw(self, data=None):
         """
-        :return: Object for communicating with C interface for current image data
+        Redraw image
+        :param data: frame to draw, associated data if None
         """
-        return self._data.ctypes
+        with self.profiler.stage("update"):
+            self._update(data if data is not None else self._data)
 
-    @property
-    def corig(self):
-        """
-        :return: Object for communicating with C interface for data of original image
-        """
-        return self._orig.ctypes
-
-    def _compute_mask(self):
-        """ Compute mask of image - foreground is True, background is False """
-        self._mask = np.full((self.height, self.width), True, dtype=np.bool)
-        self.cw.mask(self.cmask, self.corig, self.width, self.height, 10)
-
-    def _update(self):
-        """ Create new image from current data """
-        self._im_obj = Image.fromarray(self._data)  # putdata(self._data)
-        self._tk_obj = ImageTk.PhotoImage(self._im_obj)  # need to keep reference for image to load
-
-    def draw(self):
-        """ Redraw image from associated data """
-        self._update()
-
-        self._canvas.delete("IMAGE")
-        self._canvas.create_image(self._pos, image=self._tk_obj, tag="IMAGE")
+        if self._item is None:
+            self._item = self._canvas.create_image(self._pos, image=self._tk_obj, tag="IMAGE")
 
         for h in self._handles:
             self._canvas.tag_raise(h)
@@ -125,6 +97,9 @@ class ImageHelper:
         bbox = (x-self.HANDLE_RADIUS, y-self.HANDLE_RADIUS, x+self.HANDLE_RADIUS, y+self.HANDLE_RADIUS)
         self._canvas.coords(handle_id, bbox)
 
+    def has_handle(self, handle_id):
+        return handle_id in self._handles
+
     def remove_handle(self, handle_id):
         """ Removes handle """
         self._canvas.delete(handle_id)
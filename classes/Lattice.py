@@ -0,0 +1,171 @@
+import numpy as np
+
+
+class Lattice:
+    """
+    Struct-of-arrays state of the embedding lattice.
+    Vertices are stored as rows of position/rest/weight arrays and boxes as rows of vertex indices,
+    so whole regularization step is computed by a handful of array operations.
+    """
+
+    def __init__(self, vertices, boxes, cw=None):
+        """
+        :param vertices: (N, 2) array of initial vertex coordinates
+        :param boxes: (M, 4) array of vertex indices of box corners in order top-left, top-right, bottom-right, bottom-left
+        :param cw: CWrapper object, regularization runs natively if given
+        """
+
+        self._cw = cw
+
+        self.rest = np.array(vertices, dtype=np.float64).reshape(-1, 2)  # initial state, doesn't change
+        self.pos = self.rest.copy()
+        self.weight = np.ones(len(self.rest))
+
+        self.boxes = np.array(boxes, dtype=np.int32).reshape(-1, 4)
+
+        # box fitted into boundaries
+        self.rigid = self.rest[self.boxes]
+
+        # number of box corners linked to each vertex
+        self._link_cnt = np.bincount(self.boxes.ravel(), minlength=len(self.rest)).astype(np.float64)
+
+        # adjacency of vertices along box edges, in compressed sparse row form
+        edges = self.boxes[:, [0, 1, 1, 2, 2, 3, 3, 0]].reshape(-1, 2)
+        edges = np.unique(np.concatenate((edges, edges[:, ::-1])), axis=0)
+        self._adj_ptr = np.concatenate(([0], np.bincount(edges[:, 0], minlength=len(self.rest)).cumsum()))
+        self._adj = edges[:, 1]
+
+        self._pc = None  # source centroids, same until weights change
+        self.compute_source_centroids()
+
+    @property
+    def vertex_count(self):
+        return len(self.rest)
+
+    @property
+    def box_count(self):
+        return len(self.boxes)
+
+    def reset_weights(self):
+        """ Set weight of each vertex to 1 """
+        self.weight.fill(1)
+
+    def neighbors(self, vertices):
+        """
+        :param vertices: array of vertex indices
+        :return: array of all vertices sharing box edge with any of given vertices, may contain duplicates
+        """
+        starts = self._adj_ptr[vertices]
+        counts = self._adj_ptr[vertices+1] - starts
+        offsets = np.repeat(starts - (counts.cumsum() - counts), counts)
+        return self._adj[offsets + np.arange(counts.sum())]
+
+    def distances(self, sources, limit):
+        """
+        Breadth first search over box edges from all sources at once
+        :param sources: indices of source vertices
+        :param limit: maximal distance searched
+        :return: array of distances of vertices from the closest source in box edges, -1 for vertices further than limit
+        """
+        dist = np.full(self.vertex_count, -1, dtype=np.int64)
+        frontier = np.unique(np.asarray(sources, dtype=np.int64))
+        dist[frontier] = 0
+
+        d = 0
+        while len(frontier) != 0 and d < limit:
+            d += 1
+            frontier = self.neighbors(frontier)
+            frontier = np.unique(frontier[dist[frontier] == -1])
+            dist[frontier] = d
+
+        return dist
+
+    def propagate_weights(self, sources, weight, falloff):
+        """
+        Set weights of sources to given weight, decreasing by falloff per box edge with distance from them.
+        Weight never drops below 1, which is also weight of vertices without any source in reach.
+        """
+        limit = int(np.ceil(weight / falloff))
+        dist = self.distances(sources, limit)
+
+        w = weight - dist * float(falloff)
+        self.weight[:] = np.where((dist >= 0) & (w > 1), w, 1)
+
+    def compute_source_centroids(self):
+        w = self.weight[self.boxes]
+        self._pc = np.einsum('bi,bij->bj', w, self.rest[self.boxes]) / w.sum(axis=1)[:, None]
+
+    def fit(self):
+        """
+        Computes the best rotation and translation of all rigid boxes to minimize distance to boundaries
+        """
+
+        w = self.weight[self.boxes]
+        q = self.pos[self.boxes]
+
+        qc = np.einsum('bi,bij->bj', w, q) / w.sum(axis=1)[:, None]
+
+        p_roof = self.rest[self.boxes] - self._pc[:, None, :]
+        q_roof = q - qc[:, None, :]
+
+        pq_x = p_roof[..., 0] * q_roof[..., 0]
+        pq_y = p_roof[..., 1] * q_roof[..., 1]
+        pq_xy = p_roof[..., 0] * q_roof[..., 1]
+        pq_yx = p_roof[..., 1] * q_roof[..., 0]
+
+        r_00 = (w * (pq_x + pq_y)).sum(axis=1)
+        r_01 = (w * (pq_xy - pq_yx)).sum(axis=1)
+
+        mi = 1 / np.sqrt(r_00**2 + r_01**2)
+        r_00 *= mi
+        r_01 *= mi
+
+        # rotation [[r_00, r_01], [-r_01, r_00]] applied as in Point.rotate
+        self.rigid[..., 0] = r_00[:, None] * p_roof[..., 0] - r_01[:, None] * p_roof[..., 1] + qc[:, None, 0]
+        self.rigid[..., 1] = r_01[:, None] * p_roof[..., 0] + r_00[:, None] * p_roof[..., 1] + qc[:, None, 1]
+
+    def average(self):
+        """ Moves each vertex to the average of rigid box corners linked to it """
+        idx = self.boxes.ravel()
+        n = self.vertex_count
+        self.pos[:, 0] = np.bincount(idx, self.rigid[..., 0].ravel(), minlength=n) / self._link_cnt
+        self.pos[:, 1] = np.bincount(idx, self.rigid[..., 1].ravel(), minlength=n) / self._link_cnt
+
+    def regularize(self, pinned=None, targets=None, iterations=1, tolerance=0):
+        """
+        Iterations of shape matching, stopped early once residual is below tolerance
+        :param pinned: indices of vertices moved to their targets before each fitting
+        :param targets: (K, 2) array of target positions of pinned vertices
+        :return: (number of iterations done, residual),
+                 residual is maximal vertex displacement caused by the last iteration
+        """
+        pinned = np.ascontiguousarray(pinned if pinned is not None else [], dtype=np.int32)
+        targets = np.ascontiguousarray(targets if targets is not None else [], dtype=np.float64).reshape(-1, 2)
+
+        if self._cw is not None:
+            return self._cw.regularize(
+                self.pos.ctypes, self.rest.ctypes, self.weight.ctypes, self._link_cnt.ctypes, self.vertex_count,
+                self.boxes.ctypes, self._pc.ctypes, self.rigid.ctypes, self.box_count,
+                pinned.ctypes, targets.ctypes, len(pinned),
+                iterations, tolerance
+            )
+
+        residual = 0
+        for i in range(0, iterations):
+            last = self.pos.copy()
+
+            self.pos[pinned] = targets
+            self.fit()
+            self.average()
+
+            residual = np.abs(self.pos - last).max(initial=0)
+            if residual < tolerance:
+                return i+1, residual
+
+        return iterations, residual
+
+    def corners(self):
+        """
+        :return: (M, 4, 2) array of current positions of box corners
+        """
+        return self.pos[self.boxes]
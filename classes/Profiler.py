@@ -0,0 +1,104 @@
+import collections
+import contextlib
+import csv
+import json
+import threading
+import time
+
+import numpy as np
+
+
+class Profiler:
+    """
+    Records durations of pipeline stages and reports their rolling percentiles.
+    Only the last WINDOW samples of each stage are kept, so memory stays bounded during long sessions.
+    Stages may be recorded from several threads.
+    """
+
+    """ number of samples kept per stage """
+    WINDOW = 300
+
+    """ stages in order of the pipeline, regularize to draw """
+    STAGES = ("regularize", "homography", "clear", "project", "update", "draw")
+
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, enabled=True, window=WINDOW):
+        """
+        :param enabled: disabled profiler records nothing and costs next to nothing
+        :param window: number of samples kept per stage, all are kept if None
+        """
+        self.enabled = enabled
+        self._window = window
+        self._lock = threading.Lock()
+        self._samples = collections.OrderedDict((name, collections.deque(maxlen=window)) for name in self.STAGES)
+        self._counts = dict.fromkeys(self.STAGES, 0)
+
+    def stage(self, name):
+        """
+        Context manager measuring duration of its body as sample of given stage
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._measure(name)
+
+    @contextlib.contextmanager
+    def _measure(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, duration):
+        """
+        :param duration: duration in seconds
+        """
+        with self._lock:
+            if name not in self._samples:
+                self._samples[name] = collections.deque(maxlen=self._window)
+                self._counts[name] = 0
+            self._samples[name].append(duration)
+            self._counts[name] += 1
+
+    def summary(self):
+        """
+        :return: dict of stage name: dict of count, mean, max and percentiles in milliseconds over the window,
+                 stages without samples are left out
+        """
+        with self._lock:
+            samples = [(name, np.array(s) * 1000, self._counts[name]) for name, s in self._samples.items() if s]
+
+        result = collections.OrderedDict()
+        for name, ms, count in samples:
+            stats = collections.OrderedDict(count=count, mean=float(ms.mean()), max=float(ms.max()))
+            for p, value in zip(self.PERCENTILES, np.percentile(ms, self.PERCENTILES)):
+                stats["p{}".format(p)] = float(value)
+            result[name] = stats
+        return result
+
+    def dump(self, path):
+        """ Writes summary as JSON, or as CSV if path ends with .csv """
+        summary = self.summary()
+        with open(path, "w", newline="") as f:
+            if path.lower().endswith(".csv"):
+                fields = ["count", "mean", "max"] + ["p{}".format(p) for p in self.PERCENTILES]
+                writer = csv.writer(f)
+                writer.writerow(["stage"] + fields)
+                for name, stats in summary.items():
+                    writer.writerow([name] + ["{:.3f}".format(stats[k]) if k != "count" else stats[k] for k in fields])
+            else:
+                json.dump(summary, f, indent=4)
+
+    def lines(self):
+        """
+        :return: list of human readable summary lines, one per stage
+        """
+        return ["{:<10} p50 {:6.2f}  p95 {:6.2f}  p99 {:6.2f} ms".format(name, s["p50"], s["p95"], s["p99"])
+                for name, s in self.summary().items()]
+
+    def overlay(self, canvas, x=5, y=5):
+        """ Draws summary in top left corner of canvas, replacing previously drawn one """
+        canvas.delete("PROFILE")
+        canvas.create_text(x, y, text="\n".join(self.lines()), anchor="nw", font=("Courier", 9),
+                           fill="red", tag="PROFILE")
@@ -0,0 +1,64 @@
+import struct
+import time
+
+
+class Recording:
+    """
+    Timestamped handle events of a deformation session, storable in compact binary format.
+
+    File starts with header (magic, version, length of image path) followed by UTF-8 image path,
+    then fixed size events (time in seconds, kind, handle ID, x, y), all little endian.
+    """
+
+    MAGIC = b"ARAP"
+    VERSION = 1
+
+    CREATE = 0
+    MOVE = 1
+    REMOVE = 2
+
+    _HEADER = struct.Struct("<4sHH")
+    _EVENT = struct.Struct("<dBiff")
+
+    def __init__(self, image=""):
+        """
+        :param image: path to deformed image
+        """
+        self.image = image
+        self.events = []  # (time, kind, handle id, x, y)
+        self._start = None
+
+    @property
+    def duration(self):
+        return self.events[-1][0] if self.events else 0
+
+    def record(self, kind, handle_id, x, y):
+        """ Stores event, time is measured from the first recorded event """
+        now = time.perf_counter()
+        if self._start is None:
+            self._start = now
+        self.events.append((now - self._start, kind, handle_id, x, y))
+
+    def save(self, path):
+        image = self.image.encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(self._HEADER.pack(self.MAGIC, self.VERSION, len(image)))
+            f.write(image)
+            for event in self.events:
+                f.write(self._EVENT.pack(*event))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            data = f.read()
+
+        magic, version, length = cls._HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("{} is not a recording of version {}".format(path, cls.VERSION))
+
+        offset = cls._HEADER.size
+        recording = cls(data[offset:offset+length].decode("utf-8"))
+        offset += length
+
+        recording.events = list(cls._EVENT.iter_unpack(data[offset:]))
+        return recording
@@ -0,0 +1,126 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class RenderWorker(threading.Thread):
+    """
+    Regularizes grid and projects image in background thread, so that GUI thread only handles input and blits frames.
+
+    Worker owns the grid and image buffers, other threads communicate with it only through command queue
+    and finished frames. Frames are double buffered: image is projected into back buffer, which is then
+    swapped with front buffer under lock. Back buffer is first synced with front buffer,
+    so incremental reprojection of grid stays valid. Snapshot of grid lines is published together with the frame.
+    """
+
+    """ maximal number of regularization iterations between two checks of commands """
+    ITERATIONS = 20
+
+    """ minimal time between two frames in seconds """
+    FRAME_INTERVAL = 1/30
+
+    CREATE = 0
+    REMOVE = 1
+    TARGET = 2
+    STOP = 3
+
+    def __init__(self, image, grid, iterations=ITERATIONS):
+        """
+        :param image: ImageData object the grid projects into
+        :param grid: Grid object, not to be touched by other threads once worker starts
+        :param iterations: maximal number of regularization iterations between two checks of commands
+        """
+        super().__init__(daemon=True)
+
+        self._image = image
+        self._grid = grid
+        self._iterations = iterations
+
+        self._commands = queue.Queue()
+        self.results = queue.Queue()  # IDs of handles whose control point couldn't be created
+
+        self._lock = threading.Lock()
+        self._front = image.data.copy()
+        self._lines = None  # grid lines of front buffer
+        self._fresh = False  # front buffer wasn't presented yet
+
+    def create_control_point(self, handle_id, x, y):
+        self._commands.put((self.CREATE, handle_id, x, y))
+
+    def remove_control_point(self, handle_id):
+        self._commands.put((self.REMOVE, handle_id))
+
+    def set_control_target(self, handle_id, x, y):
+        self._commands.put((self.TARGET, handle_id, x, y))
+
+    def stop(self):
+        """ Stops worker and waits until it ends """
+        self._commands.put((self.STOP,))
+        self.join()
+
+    def present(self, fn):
+        """
+        Calls fn with the latest frame if it wasn't presented yet, frame isn't overwritten until fn returns
+        :param fn: called as fn(frame, lines) with lines as returned by Grid.lines()
+        :return: whether fn was called
+        """
+        with self._lock:
+            if not self._fresh:
+                return False
+            fn(self._front, self._lines)
+            self._fresh = False
+            return True
+
+    def _apply(self, command):
+        """
+        :return: False if worker should stop
+        """
+        kind = command[0]
+        if kind == self.CREATE:
+            if not self._grid.create_control_point(*command[1:]):
+                self.results.put(command[1])
+        elif kind == self.REMOVE:
+            self._grid.remove_control_point(command[1])
+        elif kind == self.TARGET:
+            self._grid.set_control_target(*command[1:])
+        else:
+            return False
+        return True
+
+    def _render(self):
+        self._grid.project()
+        lines = self._grid.lines()
+
+        back = self._image.data
+        with self._lock:
+            self._image.data, self._front = self._front, back
+            self._lines = lines
+            self._fresh = True
+        np.copyto(self._image.data, back)
+
+    def run(self):
+        pending = False  # grid changed since the last frame
+        t_last = 0
+
+        while True:
+            # wait for commands only once everything is drawn
+            idle = self._grid.converged and not pending
+            try:
+                command = self._commands.get(block=idle)
+                while True:
+                    if not self._apply(command):
+                        return
+                    command = self._commands.get_nowait()
+            except queue.Empty:
+                pass
+
+            if self._grid.regularize(self._iterations):
+                pending = True
+
+            now = time.perf_counter()
+            if pending and (now - t_last > self.FRAME_INTERVAL or self._grid.converged):
+                self._render()
+                pending = False
+                t_last = now
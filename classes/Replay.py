@@ -0,0 +1,56 @@
+import math
+
+from classes.Recording import Recording
+
+
+class Replay:
+    """
+    Re-runs recorded handle events through Deformer at fixed timestep.
+    Every frame does the same number of iterations regardless of real time, so replay is deterministic.
+    """
+
+    def __init__(self, recording, deformer, fps=30, iterations=20):
+        """
+        :param recording: Recording object
+        :param deformer: Deformer object with the recorded image
+        :param fps: frames per second of recorded time
+        :param iterations: maximal number of regularization iterations per frame
+        """
+        self._recording = recording
+        self._deformer = deformer
+        self._fps = fps
+        self._iterations = iterations
+
+        self._handles = {}  # recorded handle id: deformer handle id
+
+    @property
+    def frame_count(self):
+        return int(math.ceil(self._recording.duration * self._fps)) + 1
+
+    def _apply(self, kind, handle_id, x, y):
+        if kind == Recording.CREATE:
+            new_id = self._deformer.add_control_point(x, y)
+            if new_id != -1:
+                self._handles[handle_id] = new_id
+        elif handle_id in self._handles:
+            if kind == Recording.MOVE:
+                self._deformer.set_target(self._handles[handle_id], x, y)
+            elif kind == Recording.REMOVE:
+                self._deformer.remove_control_point(self._handles.pop(handle_id))
+
+    def frames(self):
+        """
+        Generates rendered frames
+        :return: iterator of (frame number, image data array), array is overwritten by next frame
+        """
+        events = iter(self._recording.events)
+        pending = next(events, None)
+
+        for frame in range(0, self.frame_count):
+            t = frame / self._fps
+            while pending is not None and pending[0] <= t:
+                self._apply(*pending[1:])
+                pending = next(events, None)
+
+            self._deformer.grid.regularize(self._iterations)
+            yield frame, self._deformer.render()
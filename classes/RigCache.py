@@ -0,0 +1,103 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+
+class RigCache:
+    """
+    On-disk cache of image mask and lattice arrays, so repeated loads of the same image skip their computation.
+
+    Entries are keyed by hash of image content together with box size and mask tolerance.
+    Each entry is a directory of .npy files, which are memory-mapped on load.
+    Once the cache exceeds its size, least recently used entries are evicted.
+    """
+
+    """ default maximal size of all entries in bytes """
+    MAX_BYTES = 256 * 1024 * 1024
+
+    """ version of mask and lattice computation, bumped whenever it changes, so that old entries are not served """
+    VERSION = 2
+
+    NAMES = ("mask", "origin", "occupied", "index", "vertices", "boxes")
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        """
+        :param directory: cache directory, created if it doesn't exist
+        :param max_bytes: maximal size of all entries
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(im, box_size, tolerance):
+        """
+        :param im: PIL Image
+        :param box_size: size of lattice box
+        :param tolerance: tolerance of background color of mask
+        :return: hex digest identifying the entry
+        """
+        h = hashlib.sha1()
+        h.update("{} {} {} {} {} {}".format(RigCache.VERSION, im.mode, im.size[0], im.size[1], box_size, tolerance)
+                 .encode("ascii"))
+        h.update(im.tobytes())
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        :return: dict of read-only memory-mapped arrays, None if there is no such entry
+        """
+        path = os.path.join(self.directory, key)
+        try:
+            arrays = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in self.NAMES}
+        except (OSError, ValueError):
+            return None
+
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            return None  # evicted meanwhile by another process
+        return arrays
+
+    def put(self, key, arrays):
+        """
+        Stores entry and evicts old ones if cache is too large
+        :param arrays: dict of arrays with names from NAMES
+        """
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            return
+
+        # written aside and renamed, so that concurrent loads never see incomplete entry
+        tmp = tempfile.mkdtemp(dir=self.directory, prefix=".tmp-")
+        for name in self.NAMES:
+            np.save(os.path.join(tmp, name + ".npy"), np.ascontiguousarray(arrays[name]))
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)  # stored meanwhile by another process
+
+        self.evict()
+
+    def evict(self):
+        """ Removes least recently used entries until all entries fit into max_bytes """
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(path))
+                entries.append((os.stat(path).st_mtime, size, path))
+            except OSError:
+                continue  # evicted meanwhile by another process
+
+        total = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,68 @@
+import numpy as np
+
+
+class SpatialIndex:
+    """
+    Uniform grid of cells over the plane, each cell lists items whose bounding box overlaps it.
+    Point queries look at a single cell, so they take constant time for evenly sized items.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+
+        self._bboxes = np.empty((0, 4))
+        self._origin = (0, 0)  # cell coordinates of the first cell
+        self._cols = 0
+        self._rows = 0
+        self._ptr = np.zeros(1, dtype=np.intp)
+        self._items = np.empty(0, dtype=np.intp)
+
+    def __len__(self):
+        return len(self._bboxes)
+
+    def update(self, bboxes):
+        """
+        Rebuilds the index
+        :param bboxes: (M, 4) array of item bounding boxes as [x_min, y_min, x_max, y_max], item ID is its row
+        """
+        self._bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        if len(self._bboxes) == 0:
+            self._cols = self._rows = 0
+            self._ptr = np.zeros(1, dtype=np.intp)
+            self._items = np.empty(0, dtype=np.intp)
+            return
+
+        lo = np.floor(self._bboxes[:, :2] / self.cell_size).astype(np.intp)
+        hi = np.floor(self._bboxes[:, 2:] / self.cell_size).astype(np.intp)
+
+        origin = lo.min(axis=0)
+        self._origin = (origin[0], origin[1])
+        self._cols, self._rows = hi.max(axis=0) - origin + 1
+
+        # expand every item to all cells it overlaps
+        span = hi - lo + 1
+        counts = span[:, 0] * span[:, 1]
+        items = np.repeat(np.arange(len(counts)), counts)
+        k = np.arange(counts.sum()) - np.repeat(counts.cumsum() - counts, counts)
+        cx = lo[items, 0] + k % span[items, 0] - origin[0]
+        cy = lo[items, 1] + k // span[items, 0] - origin[1]
+        cells = cy * self._cols + cx
+
+        order = np.argsort(cells, kind="stable")  # items stay ascending inside of each cell
+        self._items = items[order]
+        self._ptr = np.concatenate(([0], np.bincount(cells, minlength=self._cols*self._rows).cumsum()))
+
+    def query(self, x, y):
+        """
+        :return: array of IDs of items whose bounding box contains given point, in ascending order
+        """
+        cx = int(np.floor(x / self.cell_size)) - self._origin[0]
+        cy = int(np.floor(y / self.cell_size)) - self._origin[1]
+        if not (0 <= cx < self._cols and 0 <= cy < self._rows):
+            return np.empty(0, dtype=np.intp)
+
+        cell = cy * self._cols + cx
+        candidates = self._items[self._ptr[cell]:self._ptr[cell+1]]
+
+        b = self._bboxes[candidates]
+        return candidates[(b[:, 0] <= x) & (x <= b[:, 2]) & (b[:, 1] <= y) & (y <= b[:, 3])]
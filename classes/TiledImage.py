@@ -0,0 +1,205 @@
+import json
+import mmap
+import os
+
+import numpy as np
+from PIL import Image
+
+from classes.ImageData import ImageData
+
+
+class TiledImage:
+    """
+    Image backed by memory-mapped raw files instead of arrays in memory, for images too large to load whole.
+
+    Source is raw file of packed RGB or RGBA pixels, row after row. Mask is stored next to it
+    as raw file of one byte per pixel, with JSON file describing what it was computed from.
+    It is computed again whenever that doesn't match the current source.
+    Output is written to another raw file tile by tile, source pages are released after each tile
+    and output pages after each row of tiles, so only pages of the tiles being projected stay resident.
+    Has the same interface as ImageData as far as Grid is concerned, except for current data.
+    """
+
+    """ size of square tile of projection """
+    TILE_SIZE = 1024
+
+    """ number of rows of pixels converted or masked at once """
+    ROWS = 256
+
+    MASK_TOLERANCE = ImageData.MASK_TOLERANCE
+
+    def __init__(self, cw, source, width, height, channels, output):
+        """
+        :param cw: CWrapper object
+        :param source: path to raw file of source image
+        :param width: width of image
+        :param height: height of image
+        :param channels: 3 for RGB, 4 for RGBA
+        :param output: path to raw file of output image, created or overwritten
+        """
+        self.cw = cw
+
+        self._size = (width, height)
+        self._orig, self._orig_map = self._map(source, (height, width, channels), np.uint8)
+        self._output, self._output_map = self._map(output, (height, width, channels), np.uint8, create=True)
+
+        mask_path = source + ".mask"
+        info = self._mask_info(source)
+        if self._load_info(mask_path + ".json") == info:
+            self._mask, self._mask_map = self._map(mask_path, (height, width), np.bool_)
+        else:
+            self._mask, self._mask_map = self._compute_mask(mask_path, info)
+
+    @classmethod
+    def convert(cls, path, raw):
+        """
+        Converts image to raw file, normalizing its mode the same way as ImageData.
+        Mask stored for previous content of raw file is removed.
+        :return: (width, height, channels)
+        """
+        for stale in (raw + ".mask.json", raw + ".mask"):
+            if os.path.exists(stale):
+                os.remove(stale)
+
+        im = Image.open(path)
+        mode = "RGBA" if im.mode in ("RGBA", "LA", "PA") or "transparency" in im.info else "RGB"
+        with open(raw, "wb") as f:
+            for y in range(0, im.height, cls.ROWS):
+                f.write(im.crop((0, y, im.width, min(y + cls.ROWS, im.height))).convert(mode).tobytes())
+        return im.width, im.height, len(mode)
+
+    @property
+    def width(self):
+        return self._size[0]
+
+    @property
+    def height(self):
+        return self._size[1]
+
+    @property
+    def channels(self):
+        return self._orig.shape[2]
+
+    @property
+    def mask(self):
+        return self._mask
+
+    @property
+    def output(self):
+        return self._output
+
+    @property
+    def cmask(self):
+        return self._mask.ctypes
+
+    @property
+    def corig(self):
+        return self._orig.ctypes
+
+    @staticmethod
+    def _map(path, shape, dtype, create=False):
+        """
+        Memory-maps raw file as array
+        :param create: file is created or overwritten with given shape and mapped writable, otherwise read-only
+        :return: (array, mmap object)
+        """
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, "w+b" if create else "rb") as f:
+            if create:
+                f.truncate(size)
+            elif os.fstat(f.fileno()).st_size < size:
+                raise ValueError("{} is smaller than {}x{} image".format(path, shape[1], shape[0]))
+            m = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_WRITE if create else mmap.ACCESS_READ)
+        return np.frombuffer(m, dtype=dtype).reshape(shape), m
+
+    def _mask_info(self, source):
+        """
+        :return: dict identifying the mask of the source, stored with the mask
+        """
+        stat = os.stat(source)
+        return {
+            "width": self.width,
+            "height": self.height,
+            "channels": self.channels,
+            "tolerance": self.MASK_TOLERANCE,
+            "source_size": stat.st_size,
+            "source_mtime": stat.st_mtime_ns
+        }
+
+    @staticmethod
+    def _load_info(path):
+        """
+        :return: dict stored with the mask, None if there is none
+        """
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _compute_mask(self, path, info):
+        """ Mask is opaque part of RGBA image, otherwise background is flood filled from borders """
+        # info is written only once the mask is complete, so interrupted computation is never reused
+        info_path = path + ".json"
+        if os.path.exists(info_path):
+            os.remove(info_path)
+
+        mask, m = self._map(path, (self.height, self.width), np.bool_, create=True)
+        for y in range(0, self.height, self.ROWS):
+            if self.channels == 4:
+                mask[y:y+self.ROWS] = self._orig[y:y+self.ROWS, :, 3] > 0
+            else:
+                mask[y:y+self.ROWS] = True
+
+        # flood fill is the only pass over whole source, its pages are released right after
+        if self.channels != 4:
+            self.cw.mask(mask.ctypes, self.corig, self.width, self.height, self.channels, self.MASK_TOLERANCE)
+        self._release(m, 0, len(m))
+        self._release(self._orig_map, 0, len(self._orig_map))
+
+        with open(info_path, "w") as f:
+            json.dump(info, f)
+        return mask, m
+
+    @staticmethod
+    def _release(m, start, stop):
+        """
+        Flushes and unmaps pages of byte range of mmap object,
+        they stay in page cache, but don't count to memory of the process anymore
+        """
+        start -= start % mmap.PAGESIZE
+        stop = min(stop + (-stop) % mmap.PAGESIZE, len(m))
+        if stop <= start:
+            return
+        m.flush(start, stop - start)
+        if hasattr(m, "madvise"):
+            m.madvise(mmap.MADV_DONTNEED, start, stop - start)
+
+    def _write(self, x, y, data):
+        h, w = data.shape[:2]
+        self._output[y:y+h, x:x+w] = data
+
+        # deformed tile may read source from anywhere, so it is released after each tile,
+        # output only once its row of tiles is complete
+        self.release()
+        if x + w == self.width:
+            row = self.width * self.channels
+            self._release(self._output_map, y * row, (y + h) * row)
+
+    def release(self):
+        """ Releases all pages of source and mask read so far, e.g. after grid was built from mask """
+        self._release(self._orig_map, 0, len(self._orig_map))
+        self._release(self._mask_map, 0, len(self._mask_map))
+
+    def render(self, grid, tile_size=TILE_SIZE):
+        """ Projects current state of grid into output file """
+        grid.project_tiles(tile_size, self._write)
+        self._output_map.flush()
+
+    def viewport(self, x, y, width, height):
+        """
+        :return: copy of given rectangle of output, clipped to image, to be displayed
+        """
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.width), min(y + height, self.height)
+        return np.array(self._output[y0:max(y0, y1), x0:max(x0, x1)])
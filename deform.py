@@ -0,0 +1,229 @@
+"""
+Headless deformation from command line.
+
+Trajectory file is JSON of following form, paths are relative to the file:
+{
+    "image": "assets/taz.jpg",
+    "output": "frames/{:04d}.png",
+    "fps": 30,
+    "iterations": 1000,
+    "levels": 1,
+    "handles": [
+        [[x, y], [x, y], ...],
+        ...
+    ]
+}
+Each handle is a list of its positions, one per frame. First position places the handle,
+handles with shorter trajectory stay at their last position.
+
+Batch rig file is JSON of following form, coordinates are relative to image size:
+{
+    "iterations": 1000,
+    "levels": 1,
+    "handles": [
+        [[x, y], [x, y]],
+        ...
+    ]
+}
+Each handle is pair of its initial and target position.
+The same rig is used to deform large images tile by tile.
+
+Output is either pattern of image or raw frame files, or single animated .gif or raw .raw file,
+fps is used only for GIF.
+"""
+
+import argparse
+import json
+import os
+import time
+
+from PIL import Image
+
+from classes.Batch import Batch
+from classes.CWrapper import CWrapper
+from classes.Grid import Grid
+from classes.Deformer import Deformer
+from classes.Exporter import Exporter
+from classes.Profiler import Profiler
+from classes.Recording import Recording
+from classes.Replay import Replay
+from classes.RigCache import RigCache
+from classes.TiledImage import TiledImage
+
+
+def cache(args):
+    return RigCache(args.cache) if args.cache is not None else None
+
+
+def measure(args, grid):
+    """ Enables measuring of stages of grid if requested """
+    if args.profile is not None:
+        grid.profiler = Profiler(window=None)
+
+
+def report(args, grid):
+    if args.profile is not None:
+        grid.profiler.dump(args.profile)
+        if not args.quiet:
+            print("\n".join(grid.profiler.lines()))
+
+
+def run_trajectory(args):
+    with open(args.file) as f:
+        spec = json.load(f)
+
+    root = os.path.dirname(os.path.abspath(args.file))
+    output = args.output or os.path.join(root, spec["output"])
+    iterations = spec.get("iterations", 1000)
+
+    deformer = Deformer(os.path.join(root, spec["image"]), levels=spec.get("levels"), cache=cache(args))
+    measure(args, deformer.grid)
+
+    trajectories = spec["handles"]
+    handles = []
+    for trajectory in trajectories:
+        handle_id = deformer.add_control_point(*trajectory[0])
+        if handle_id == -1:
+            raise SystemExit("Handle at {} is outside of the image".format(trajectory[0]))
+        handles.append(handle_id)
+
+    frames = max(len(t) for t in trajectories) if trajectories else 1
+    with Exporter(output, spec.get("fps", 30), args.workers) as exporter:
+        for frame in range(0, frames):
+            for handle_id, trajectory in zip(handles, trajectories):
+                deformer.set_target(handle_id, *trajectory[min(frame, len(trajectory)-1)])
+
+            done = deformer.solve(iterations)
+            exporter.write(deformer.render())
+
+            if not args.quiet:
+                print("frame {}/{}: {} iterations".format(frame+1, frames, done))
+
+    report(args, deformer.grid)
+
+
+def run_replay(args):
+    recording = Recording.load(args.file)
+    deformer = Deformer(args.image or recording.image, levels=args.levels, cache=cache(args))
+    replay = Replay(recording, deformer, args.fps, args.iterations)
+    measure(args, deformer.grid)
+
+    start = time.perf_counter()
+    with Exporter(args.output, args.fps, args.workers) as exporter:
+        for frame, data in replay.frames():
+            exporter.write(data)
+
+    elapsed = time.perf_counter() - start
+    if not args.quiet:
+        print("{} frames of {:.2f} s recording in {:.2f} s ({:.1f} FPS)".format(
+            replay.frame_count, recording.duration, elapsed, replay.frame_count / elapsed))
+
+    report(args, deformer.grid)
+
+
+def run_batch(args):
+    with open(args.rig) as f:
+        rig = json.load(f)
+
+    batch = Batch(rig["handles"], args.output, args.processes, rig.get("levels"), rig.get("iterations", 1000),
+                  args.cache)
+    for i, (path, output, done, error) in enumerate(batch.run(args.images)):
+        if error is not None:
+            print("[{}/{}] {}: {}".format(i+1, len(args.images), path, error))
+        elif not args.quiet:
+            print("[{}/{}] {} -> {}: {} iterations".format(i+1, len(args.images), path, output, done))
+
+    print("{} images in {:.2f} s ({:.2f} images/s), {} failed".format(
+        batch.done, batch.elapsed, batch.throughput, batch.failed))
+
+
+def run_tiled(args):
+    with open(args.rig) as f:
+        rig = json.load(f)
+
+    source = args.source
+    if args.size is None:
+        source = args.output + ".source"
+        width, height, channels = TiledImage.convert(args.source, source)
+    else:
+        width, height = args.size
+        channels = args.channels
+
+    cw = CWrapper()
+    start = time.perf_counter()
+    image = TiledImage(cw, source, width, height, channels, args.output)
+    grid = Grid(cw, image, rig.get("levels"))
+    image.release()
+    measure(args, grid)
+
+    handles = []
+    for i, ((x, y), _) in enumerate(rig["handles"]):
+        if not grid.create_control_point(i, x * width, y * height):
+            raise SystemExit("Handle at {} is outside of the image".format((x, y)))
+        handles.append(i)
+    for i, (_, (x, y)) in zip(handles, rig["handles"]):
+        grid.set_control_target(i, x * width, y * height)
+
+    grid.regularize(rig.get("iterations", 1000))
+    image.render(grid, args.tile)
+
+    if args.viewport is not None:
+        Image.fromarray(image.viewport(*args.viewport)).save(args.preview)
+
+    if not args.quiet:
+        print("{}x{} image, {} boxes, {} iterations in {:.2f} s".format(
+            width, height, grid.lattice.box_count, grid.iterations, time.perf_counter() - start))
+    report(args, grid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless As Rigid As Possible image deformation")
+    parser.add_argument("--cache", help="directory of cached masks and lattices of images")
+    parser.add_argument("--profile", help="JSON or CSV file to which durations of pipeline stages are dumped")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    trajectory = commands.add_parser("trajectory", help="render frames of handle trajectories from JSON file")
+    trajectory.add_argument("file", help="JSON file with image and handle trajectories")
+    trajectory.add_argument("-o", "--output", help="output path pattern, e.g. out/{:04d}.png, or .gif/.raw file")
+    trajectory.add_argument("-w", "--workers", type=int, help="number of encoding threads")
+    trajectory.add_argument("-q", "--quiet", action="store_true")
+    trajectory.set_defaults(fn=run_trajectory)
+
+    replay = commands.add_parser("replay", help="render frames of recorded session at fixed timestep")
+    replay.add_argument("file", help="recording saved by Application")
+    replay.add_argument("-o", "--output", default="frames/{:04d}.png", help="output path pattern, or .gif/.raw file")
+    replay.add_argument("--image", help="image to deform instead of the recorded one")
+    replay.add_argument("--fps", type=float, default=30)
+    replay.add_argument("--iterations", type=int, default=20, help="regularization iterations per frame")
+    replay.add_argument("--levels", type=int, help="lattice levels of multi-resolution solver")
+    replay.add_argument("-w", "--workers", type=int, help="number of encoding threads")
+    replay.add_argument("-q", "--quiet", action="store_true")
+    replay.set_defaults(fn=run_replay)
+
+    batch = commands.add_parser("batch", help="deform many images by the same rig in parallel")
+    batch.add_argument("rig", help="JSON file with handles in relative coordinates")
+    batch.add_argument("images", nargs="+", help="image paths")
+    batch.add_argument("-o", "--output", default="out/{name}.png", help="output path pattern, {name} is image name")
+    batch.add_argument("-j", "--processes", type=int, help="number of worker processes")
+    batch.add_argument("-q", "--quiet", action="store_true")
+    batch.set_defaults(fn=run_batch)
+
+    tiled = commands.add_parser("tiled", help="deform large image by the same rig as batch, tile by tile")
+    tiled.add_argument("source", help="image, or raw RGB/RGBA file if --size is given")
+    tiled.add_argument("rig", help="JSON file with handles in relative coordinates")
+    tiled.add_argument("-o", "--output", default="out.raw", help="raw output file")
+    tiled.add_argument("--size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"), help="size of raw source")
+    tiled.add_argument("--channels", type=int, default=3, choices=[3, 4], help="channels of raw source")
+    tiled.add_argument("--tile", type=int, default=TiledImage.TILE_SIZE, help="size of projected tile")
+    tiled.add_argument("--viewport", type=int, nargs=4, metavar=("X", "Y", "WIDTH", "HEIGHT"),
+                       help="part of output saved as preview")
+    tiled.add_argument("--preview", default="preview.png", help="image file of viewport")
+    tiled.add_argument("-q", "--quiet", action="store_true")
+    tiled.set_defaults(fn=run_tiled)
+
+    args = parser.parse_args()
+    args.fn(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,15 @@
+import argparse
+
 from classes.Application import Application
+from classes.RigCache import RigCache
+
+parser = argparse.ArgumentParser(description="As Rigid As Possible image deformation")
+parser.add_argument("image", nargs="?", default="assets/taz.jpg")
+parser.add_argument("--record", help="file to which handle events are recorded for deform.py replay")
+parser.add_argument("--profile", help="JSON or CSV file to which durations of pipeline stages are dumped")
+args = parser.parse_args()
 
-app = Application("assets/taz.jpg")
+app = Application(args.image, record=args.record, cache=RigCache("cache"), profile=args.profile)
 
 app.bind("<Button-1>", app.select_handle)
 app.bind("<ButtonRelease-1>", app.deselect_handle)
@@ -8,4 +17,3 @@ app.bind("<Button-3>", app.remove_handle)
 app.bind("<B1-Motion>", app.move_handle)
 
 app.run()
-